@@ -0,0 +1,331 @@
+import json
+import threading
+
+import bitsets
+import db
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def init_attendance_db():
+    """Create the attendance tables, indexes and rollups once per process."""
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with db.transaction(db.ATTENDANCE_DB) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS attendance_records (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    date TEXT NOT NULL,  -- YYYY-MM-DD
+                    student_name TEXT NOT NULL,
+                    time TEXT,  -- HH:MM:SS the student was marked, if known
+                    course TEXT NOT NULL DEFAULT ''  -- '' for records from before courses were recorded
+                )
+            """)
+            _split_timestamps(conn)
+            added_course = _add_course(conn)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS present_today (
+                    username TEXT PRIMARY KEY,
+                    timestamp TEXT NOT NULL
+                )
+            """)
+            has_unique_index = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_attendance_date_student_course'"
+            ).fetchone()
+            if not has_unique_index:
+                # Older databases may already hold repeated submissions; keep the first of each
+                conn.execute("""
+                    DELETE FROM attendance_records
+                    WHERE id NOT IN (SELECT MIN(id) FROM attendance_records GROUP BY date, student_name, course)
+                """)
+            # A student is recorded once per course per day
+            conn.execute("DROP INDEX IF EXISTS idx_attendance_date_student")
+            conn.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_date_student_course
+                ON attendance_records (date, student_name, course)
+            """)
+            # Newest-first paging and per-student lookups
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance_records (date)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_attendance_student ON attendance_records (student_name, date)")
+            _create_rollups(conn)
+        _schema_ready = True
+    bitsets.init_bitsets_db()
+    if added_course:
+        # Bitsets built before records kept their course may have a student in every course they take
+        bitsets.rebuild()
+
+
+def _add_course(conn):
+    """Add the course column to older databases; returns True if it was added."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(attendance_records)")}
+    if "course" in columns:
+        return False
+    conn.execute("ALTER TABLE attendance_records ADD COLUMN course TEXT NOT NULL DEFAULT ''")
+    return True
+
+
+def _split_timestamps(conn):
+    # Self-marked records used to store a full timestamp in date; move the time to its own column
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(attendance_records)")}
+    if "time" in columns:
+        return
+    conn.execute("ALTER TABLE attendance_records ADD COLUMN time TEXT")
+    # One record per student per day, the first of them, so the day is unique once split off
+    conn.execute("""
+        DELETE FROM attendance_records
+        WHERE id NOT IN (SELECT MIN(id) FROM attendance_records GROUP BY substr(date, 1, 10), student_name)
+    """)
+    conn.execute("""
+        UPDATE attendance_records SET time = substr(date, 12), date = substr(date, 1, 10)
+        WHERE length(date) > 10
+    """)
+    # Their old definitions cut the day out of the timestamp; _create_rollups recreates them
+    conn.execute("DROP TRIGGER IF EXISTS attendance_records_insert")
+    conn.execute("DROP TRIGGER IF EXISTS attendance_records_delete")
+
+
+def _create_rollups(conn):
+    # attendance_days holds one row per (student, day) however many times they were marked;
+    # session_days and student_totals count those rows. Triggers keep all three in step
+    # with attendance_records, so the dashboard aggregates never scan the raw table.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS attendance_days (
+            student_name TEXT NOT NULL,
+            day TEXT NOT NULL,
+            PRIMARY KEY (student_name, day)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_attendance_days_day ON attendance_days (day)")
+    conn.execute("CREATE TABLE IF NOT EXISTS session_days (day TEXT PRIMARY KEY, present INTEGER NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS student_totals (student_name TEXT PRIMARY KEY, days INTEGER NOT NULL)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS attendance_days_insert AFTER INSERT ON attendance_days
+        BEGIN
+            INSERT INTO session_days (day, present) VALUES (NEW.day, 1)
+            ON CONFLICT (day) DO UPDATE SET present = present + 1;
+            INSERT INTO student_totals (student_name, days) VALUES (NEW.student_name, 1)
+            ON CONFLICT (student_name) DO UPDATE SET days = days + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS attendance_days_delete AFTER DELETE ON attendance_days
+        BEGIN
+            UPDATE session_days SET present = present - 1 WHERE day = OLD.day;
+            DELETE FROM session_days WHERE day = OLD.day AND present <= 0;
+            UPDATE student_totals SET days = days - 1 WHERE student_name = OLD.student_name;
+            DELETE FROM student_totals WHERE student_name = OLD.student_name AND days <= 0;
+        END
+    """)
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'attendance_records_insert'").fetchone():
+        # First run against an existing table: backfill before the triggers take over
+        conn.execute("""
+            INSERT INTO attendance_days (student_name, day)
+            SELECT DISTINCT student_name, date FROM attendance_records WHERE true
+            ON CONFLICT DO NOTHING
+        """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS attendance_records_insert AFTER INSERT ON attendance_records
+        BEGIN
+            INSERT INTO attendance_days (student_name, day) VALUES (NEW.student_name, NEW.date)
+            ON CONFLICT DO NOTHING;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS attendance_records_delete AFTER DELETE ON attendance_records
+        WHEN NOT EXISTS (
+            SELECT 1 FROM attendance_records
+            WHERE student_name = OLD.student_name AND date = OLD.date
+        )
+        BEGIN
+            DELETE FROM attendance_days WHERE student_name = OLD.student_name AND day = OLD.date;
+        END
+    """)
+
+
+def _insert(conn, date, students, course=None, section=None, time=None):
+    cursor = conn.execute(
+        """
+        INSERT INTO attendance_records (date, student_name, time, course)
+        SELECT ?, value, ?, ? FROM json_each(?) WHERE true
+        ON CONFLICT (date, student_name, course) DO NOTHING
+        """,
+        (date, time, course or "", json.dumps(list(students))),
+    )
+    if course is None:
+        # No course known (e.g. a code made before codes carried one)
+        bitsets.mark_students(conn, date, students)
+    else:
+        scope = "course = ?" + (" AND section = ?" if section is not None else "")
+        positions = conn.execute(
+            f"SELECT course, position FROM roster WHERE {scope} AND student_id IN (SELECT value FROM json_each(?))",
+            (course, *((section,) if section is not None else ()), json.dumps(list(students))),
+        ).fetchall()
+        bitsets.mark(conn, date, positions)
+    return cursor.rowcount
+
+
+def record_attendance(date, students, course=None, section=None, time=None):
+    """Mark a whole class present for a date in one statement and one transaction.
+
+    The records and bitsets are for that course's session. Without a course
+    the record has none, and only students enrolled in exactly one course get
+    a bit set. ``date`` is the day (YYYY-MM-DD) and ``time`` when it was taken.
+    Students already recorded for that course and day are skipped, so
+    retrying a submission is safe. Returns the number of newly recorded students.
+    """
+    init_attendance_db()
+    with db.transaction(db.ATTENDANCE_DB) as conn:
+        return _insert(conn, date, students, course, section, time)
+
+
+def submit_attendance(date, students, course=None, section=None, time=None):
+    """Queue a submission on the attendance writer, which commits concurrent ones together.
+
+    The course (and section) scope the record as in record_attendance.
+    Returns a Future for the number of newly recorded students; it resolves
+    once the shared transaction has committed.
+    """
+    init_attendance_db()
+    students = list(students)
+    return db.writer(db.ATTENDANCE_DB).submit(lambda conn: _insert(conn, date, students, course, section, time))
+
+
+def record_roster(date, course, section=None, exclude=(), time=None):
+    """Mark everyone enrolled in a course (or one section) present, except the given student IDs.
+
+    The roster is read inside the insert, so the class list never passes
+    through Python. Returns the number of newly recorded students.
+    """
+    init_attendance_db()
+    scope = "course = ?" + (" AND section = ?" if section is not None else "")
+    params = (course,) + ((section,) if section is not None else ())
+    with db.transaction(db.ATTENDANCE_DB) as conn:
+        cursor = conn.execute(
+            f"""
+            INSERT INTO attendance_records (date, student_name, time, course)
+            SELECT ?, student_id, ?, course FROM roster
+            WHERE {scope} AND student_id NOT IN (SELECT value FROM json_each(?))
+            ON CONFLICT (date, student_name, course) DO NOTHING
+            """,
+            (date, time, *params, json.dumps(list(exclude))),
+        )
+        positions = conn.execute(
+            f"SELECT course, position FROM roster WHERE {scope} AND student_id NOT IN (SELECT value FROM json_each(?))",
+            (*params, json.dumps(list(exclude))),
+        ).fetchall()
+        bitsets.mark(conn, date, positions)
+        return cursor.rowcount
+
+
+def fetch_records_page(limit=50, after=None, student=None):
+    """Return one page of records, newest first.
+
+    Pages are keyset-based: pass the (date, id) of the last row of the
+    previous page as ``after`` instead of an offset, so late pages cost the
+    same as the first one.
+    """
+    init_attendance_db()
+    clauses = []
+    params = []
+    if student:
+        clauses.append("student_name = ?")
+        params.append(student)
+    if after:
+        clauses.append("(date, id) < (?, ?)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return db.query(
+        db.ATTENDANCE_DB,
+        f"SELECT id, date, student_name, time, course FROM attendance_records {where} ORDER BY date DESC, id DESC LIMIT ?",
+        (*params, limit),
+    )
+
+
+def daily_counts(limit=30):
+    """Number of students present on each of the most recent session days."""
+    init_attendance_db()
+    return db.query(
+        db.ATTENDANCE_DB,
+        "SELECT day, present FROM session_days ORDER BY day DESC LIMIT ?",
+        (limit,),
+    )
+
+
+def student_stats(limit=50, after=None):
+    """Per-student attendance for one page of students, ordered by name.
+
+    Each row is (student, days present, rate %, current streak, longest streak).
+    Streaks count consecutive session days, i.e. days on which anyone was
+    marked present. Pass the last student of the previous page as ``after``.
+    """
+    init_attendance_db()
+    return db.query(
+        db.ATTENDANCE_DB,
+        """
+        WITH page AS (
+            SELECT student_name, days FROM student_totals
+            WHERE student_name > ?
+            ORDER BY student_name
+            LIMIT ?
+        ),
+        days AS MATERIALIZED (
+            SELECT day, ROW_NUMBER() OVER (ORDER BY day) AS day_no FROM session_days
+        ),
+        total AS MATERIALIZED (
+            SELECT COUNT(*) AS days FROM session_days
+        ),
+        numbered AS (
+            SELECT a.student_name, d.day_no,
+                   d.day_no - ROW_NUMBER() OVER (PARTITION BY a.student_name ORDER BY d.day_no) AS run
+            -- CROSS JOIN pins the join order so only this page's rows are read
+            FROM page
+            CROSS JOIN attendance_days a ON a.student_name = page.student_name
+            JOIN days d ON d.day = a.day
+        ),
+        runs AS (
+            SELECT student_name, COUNT(*) AS length, MAX(day_no) AS last_day
+            FROM numbered
+            GROUP BY student_name, run
+        ),
+        streaks AS MATERIALIZED (
+            SELECT student_name,
+                   MAX(CASE WHEN last_day = total.days THEN length ELSE 0 END) AS current,
+                   MAX(length) AS longest
+            FROM runs, total
+            GROUP BY student_name
+        )
+        SELECT page.student_name,
+               page.days,
+               ROUND(100.0 * page.days / total.days, 1),
+               COALESCE(streaks.current, 0),
+               COALESCE(streaks.longest, 0)
+        FROM page
+        CROSS JOIN total
+        LEFT JOIN streaks ON streaks.student_name = page.student_name
+        ORDER BY page.student_name
+        """,
+        (after or "", limit),
+    )
+
+
+def attendance_summary(class_size=None):
+    """Overall attendance rate across every session day.
+
+    The rate is student-days present divided by the number of possible
+    student-days. ``class_size`` is the enrolled head count; without it the
+    number of distinct students ever marked present is used.
+    """
+    init_attendance_db()
+    present, days = db.query_one(db.ATTENDANCE_DB, "SELECT COALESCE(SUM(present), 0), COUNT(*) FROM session_days")
+    students = db.query_one(db.ATTENDANCE_DB, "SELECT COUNT(*) FROM student_totals")[0]
+    enrolled = class_size or students
+    possible = enrolled * days
+    return {
+        "present": present,
+        "session_days": days,
+        "students": students,
+        "rate": round(100.0 * present / possible, 1) if possible else 0.0,
+    }
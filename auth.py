@@ -0,0 +1,166 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+import db
+import tracing
+
+# bcrypt releases the GIL, so a small pool runs hashes in parallel without oversubscribing the CPU
+HASH_WORKERS = os.cpu_count() or 4
+# Logins waiting for a worker beyond this are turned away instead of piling up
+MAX_PENDING = 256
+# Seconds a caller waits for its hash before giving up
+VERIFY_TIMEOUT = 30
+DEFAULT_ROUNDS = 12
+# Signed session tokens let a refresh or reconnect skip the password check
+TOKEN_TTL = 12 * 60 * 60
+
+_settings = {"rounds": DEFAULT_ROUNDS, "secret": secrets.token_bytes(32)}
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_pending = threading.BoundedSemaphore(MAX_PENDING)
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+class LoginBusyError(Exception):
+    """Raised when too many password checks are already queued."""
+
+
+def configure(secret=None, rounds=None):
+    """Set the token signing secret and the bcrypt cost factor for new hashes.
+
+    Without a configured secret a random one is used, and tokens stop
+    working when the process restarts.
+    """
+    if secret:
+        _settings["secret"] = secret.encode("utf-8") if isinstance(secret, str) else secret
+    if rounds:
+        _settings["rounds"] = int(rounds)
+
+
+def hash_password(password, rounds=None):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds or _settings["rounds"]))
+
+
+def _rounds_of(hashed):
+    # "$2b$12$..." -> 12
+    try:
+        return int(hashed.split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def _run_bounded(fn, *args):
+    if not _pending.acquire(blocking=False):
+        raise LoginBusyError("Too many logins in progress. Please try again in a moment.")
+    try:
+        future = _executor.submit(fn, *args)
+    except Exception:
+        _pending.release()
+        raise
+    future.add_done_callback(lambda _: _pending.release())
+    return future.result(timeout=VERIFY_TIMEOUT)
+
+
+def _verify(user_id, password, hashed):
+    if not bcrypt.checkpw(password.encode("utf-8"), hashed):
+        return False
+    if _rounds_of(hashed) != _settings["rounds"]:
+        # Bring old hashes up (or down) to the configured cost while we know the password
+        db.execute(db.USERS_DB, "UPDATE users SET password_hash = ? WHERE user_id = ?", (hash_password(password), user_id))
+    return True
+
+
+def verify_user(user_id, password):
+    """Check a password on the bcrypt pool; returns the user's type, or None."""
+    user = db.query_one(db.USERS_DB, "SELECT password_hash, user_type FROM users WHERE user_id = ?", (user_id,))
+    if not user:
+        return None
+    hashed_password, user_type = user
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode("utf-8")
+    # Includes time queued for a hash worker, which is what the login actually waits on
+    with tracing.span("auth", "bcrypt verify"):
+        verified = _run_bounded(_verify, user_id, password, hashed_password)
+    return user_type if verified else None
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def init_sessions_db():
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        # One row per live session token; logging out deletes it, so the token stops working at once
+        db.ensure_schema(db.USERS_DB, [
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                expires_at INTEGER NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)",
+        ])
+        _schema_ready = True
+
+
+def issue_token(user_id, user_type, issued_at=None):
+    """Return a signed token carrying the user, their type and the login time, and record its session."""
+    init_sessions_db()
+    issued_at = int(issued_at or time.time())
+    session_id = secrets.token_urlsafe(16)
+    with db.transaction(db.USERS_DB) as conn:
+        conn.execute("DELETE FROM sessions WHERE expires_at < ?", (int(time.time()),))
+        conn.execute(
+            "INSERT INTO sessions (session_id, user_id, expires_at) VALUES (?, ?, ?)",
+            (session_id, user_id, issued_at + TOKEN_TTL),
+        )
+    payload = json.dumps(
+        {"uid": user_id, "role": user_type, "sid": session_id, "iat": issued_at, "exp": issued_at + TOKEN_TTL},
+        separators=(",", ":"),
+    )
+    body = _b64(payload.encode("utf-8"))
+    signature = hmac.new(_settings["secret"], body.encode("ascii"), hashlib.sha256).digest()
+    return f"{body}.{_b64(signature)}"
+
+
+def verify_token(token):
+    """Return the token's claims if the signature is valid, it has not expired and it wasn't revoked, else None."""
+    try:
+        body, signature = token.split(".", 1)
+        expected = hmac.new(_settings["secret"], body.encode("ascii"), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _unb64(signature)):
+            return None
+        claims = json.loads(_unb64(body))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if claims.get("exp", 0) < time.time():
+        return None
+    # The signature proves who issued it; the session row proves nobody has logged out since
+    init_sessions_db()
+    if not db.query_one(db.USERS_DB, "SELECT 1 FROM sessions WHERE session_id = ? AND user_id = ?", (claims.get("sid"), claims.get("uid"))):
+        return None
+    return claims
+
+
+def revoke_token(token):
+    """End a token's session, e.g. on logout; a copy left in browser history or a shared link stops working."""
+    claims = verify_token(token)
+    if claims:
+        db.execute(db.USERS_DB, "DELETE FROM sessions WHERE session_id = ?", (claims["sid"],))
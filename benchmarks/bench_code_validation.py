@@ -0,0 +1,83 @@
+"""Attendance-code validations per second: per-call SQLite + strptime vs the in-memory code index.
+
+Run from the repository root:  python benchmarks/bench_code_validation.py --students 300
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codes  # noqa: E402
+import db  # noqa: E402
+
+
+def legacy_validate(input_code):
+    # The original validate_code: fresh connection and strptime on every lookup
+    conn = sqlite3.connect(db.CODES_DB)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT expiration_time FROM codes WHERE code = ?", (input_code,))
+        result = cursor.fetchone()
+        if result:
+            expiration_time = datetime.strptime(result[0], "%Y-%m-%d %H:%M:%S")
+            if datetime.now() <= expiration_time:
+                return True
+        return False
+    finally:
+        conn.close()
+
+
+def run(label, validate, submissions, students):
+    per_student = len(submissions) // students
+    results = []
+
+    def student(batch):
+        results.append(sum(1 for code in batch if validate(code)))
+
+    threads = [
+        threading.Thread(target=student, args=(submissions[i * per_student:(i + 1) * per_student],))
+        for i in range(students)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<22} {students * per_student / elapsed:>10.0f} validations/s  valid: {sum(results)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=300, help="concurrent students")
+    parser.add_argument("--attempts", type=int, default=20, help="submissions per student")
+    parser.add_argument("--old-codes", type=int, default=50000, help="stale codes already in the table")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        codes.init_codes_db()
+        with db.transaction(db.CODES_DB) as conn:
+            conn.executemany(
+                "INSERT INTO codes (code, expiration_time, expires_at) VALUES (?, '2024-01-01 00:00:00', 1704067200)",
+                ((f"old{i:05d}",) for i in range(args.old_codes)),
+            )
+        live, _ = codes.generate_code()
+        # Mostly the right code, with typos and stale codes mixed in
+        pool = [live] * 8 + ["zzzzzzzz", "old00042"]
+        submissions = [random.choice(pool) for _ in range(args.students * args.attempts)]
+
+        run("sqlite + strptime", legacy_validate, submissions, args.students)
+        run("in-memory index", codes.validate_code, submissions, args.students)
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Burst attendance submissions: one transaction each vs the group-commit writer.
+
+Run from the repository root:  python benchmarks/bench_group_commit.py --students 1000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import attendance  # noqa: E402
+import db  # noqa: E402
+import roster  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(label, submit, students, day):
+    """Every student submits at once, as when a teacher shows the code."""
+    start = threading.Barrier(students + 1)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def student(student_id):
+        start.wait()
+        began = time.perf_counter()
+        try:
+            submit(day, student_id)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+            return
+        with lock:
+            latencies.append(time.perf_counter() - began)
+
+    threads = [threading.Thread(target=student, args=(str(1000 + n),)) for n in range(students)]
+    for thread in threads:
+        thread.start()
+    db.reset_lock_stats()
+    began = time.perf_counter()
+    start.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    stats = db.lock_stats().get(db.ATTENDANCE_DB, {})
+    print(
+        f"{label:<26} {len(latencies) / elapsed:>8.0f} submissions/s  {elapsed:6.2f}s"
+        f"  p50 {percentile(latencies, 50) * 1000:6.1f} ms  p99 {percentile(latencies, 99) * 1000:7.1f} ms"
+        f"  transactions {stats.get('transactions', 0):>5}  errors {len(errors)}"
+    )
+    for error in {str(e) for e in errors}:
+        print(f"  {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=1000, help="students submitting at the same moment")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        roster.enroll(("PEV112", "", str(1000 + n), f"Student {n}") for n in range(args.students))
+        attendance.init_attendance_db()
+        run("transaction per submission", lambda date, student_id: attendance.record_attendance(date, [student_id]), args.students, "2026-10-19")
+        run("group commit", lambda date, student_id: attendance.submit_attendance(date, [student_id]).result(), args.students, "2026-10-20")
+        present = [day for day in ("2026-10-19", "2026-10-20") if attendance.bitsets.session("PEV112", day).bit_count() == args.students]
+        print(f"sessions with every student recorded: {len(present)} of 2")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
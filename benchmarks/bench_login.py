@@ -0,0 +1,83 @@
+"""Login throughput during a lecture-start storm: inline bcrypt vs the bcrypt pool vs session tokens.
+
+Run from the repository root:  python benchmarks/bench_login.py --students 200 --rounds 10
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import bcrypt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth  # noqa: E402
+import db  # noqa: E402
+
+
+def storm(label, login, students):
+    latencies = []
+    lock = threading.Lock()
+
+    def student(n):
+        started = time.perf_counter()
+        ok = login(n)
+        with lock:
+            latencies.append((time.perf_counter() - started, ok))
+
+    threads = [threading.Thread(target=student, args=(n,)) for n in range(students)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    times = sorted(t for t, _ in latencies)
+    p95 = times[int(len(times) * 0.95) - 1]
+    print(
+        f"{label:<18} {students / elapsed:>9.1f} logins/s  median {statistics.median(times) * 1000:8.1f} ms"
+        f"  p95 {p95 * 1000:8.1f} ms  ok: {sum(1 for _, ok in latencies if ok)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt cost factor")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        auth.configure(secret="benchmark", rounds=args.rounds)
+        db.ensure_schema(db.USERS_DB, ["""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                password_hash TEXT NOT NULL,
+                user_type TEXT NOT NULL
+            )
+        """])
+        hashed = auth.hash_password("secret")
+        db.executemany(
+            db.USERS_DB,
+            "INSERT INTO users (user_id, password_hash, user_type) VALUES (?, ?, 'student')",
+            ((str(n), hashed) for n in range(args.students)),
+        )
+
+        def inline(n):
+            # What authenticate used to do on the script thread
+            row = db.query_one(db.USERS_DB, "SELECT password_hash FROM users WHERE user_id = ?", (str(n),))
+            return bcrypt.checkpw(b"secret", row[0])
+
+        storm("inline bcrypt", inline, args.students)
+        storm("bcrypt pool", lambda n: auth.verify_user(str(n), "secret") == "student", args.students)
+
+        tokens = [auth.issue_token(str(n), "student") for n in range(args.students)]
+        storm("session token", lambda n: auth.verify_token(tokens[n]) is not None, args.students)
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
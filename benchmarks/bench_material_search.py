@@ -0,0 +1,68 @@
+"""Material search latency: FTS5 page index over thousands of documents.
+
+Run from the repository root:  python benchmarks/bench_material_search.py --documents 3000 --pages 20
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import materials  # noqa: E402
+import search  # noqa: E402
+
+TOPICS = [
+    "entropy", "thermodynamics", "momentum", "newton", "integration", "derivative", "matrix", "eigenvalue",
+    "photosynthesis", "mitochondria", "algorithm", "recursion", "probability", "variance", "equilibrium",
+    "electrolysis", "polymer", "circuit", "resistance", "capacitor", "semiconductor", "inflation", "supply",
+]
+QUERIES = ["entropy", "newton momentum", "eigen", "matrix eigenvalue derivative", "photosynthesis", "circuit resist", "variance"]
+
+
+def page_text(rng, vocabulary, words):
+    return " ".join(rng.choice(vocabulary) if rng.random() > 0.02 else rng.choice(TOPICS) for _ in range(words))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=3000)
+    parser.add_argument("--pages", type=int, default=20, help="pages per document")
+    parser.add_argument("--words", type=int, default=300, help="words per page")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))) for _ in range(20000)]
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        search.init_search_db()
+        began = time.perf_counter()
+        for n in range(args.documents):
+            material, _ = materials.save_material(f"lecture-{n}.pdf", f"document {n}".encode(), "application/pdf")
+            pages = [page_text(rng, vocabulary, args.words) for _ in range(args.pages)]
+            with db.transaction(search.SEARCH_DB) as conn:
+                search.index_material(conn, material["sha256"], material["filename"], pages)
+        db.execute(search.SEARCH_DB, "INSERT INTO material_pages (material_pages) VALUES ('optimize')")
+        elapsed = time.perf_counter() - began
+        print(f"indexed {args.documents} documents ({args.documents * args.pages} pages) in {elapsed:.1f}s")
+
+        latencies = []
+        for n in range(args.queries):
+            began = time.perf_counter()
+            results = search.search(QUERIES[n % len(QUERIES)])
+            latencies.append(time.perf_counter() - began)
+        latencies.sort()
+        print(
+            f"{args.queries} queries, {len(results)} results each: "
+            f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms  p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms"
+            f"  max {latencies[-1] * 1000:.1f} ms"
+        )
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
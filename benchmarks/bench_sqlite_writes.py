@@ -0,0 +1,88 @@
+"""Concurrent SQLite write throughput: connect-per-call vs the pooled WAL layer.
+
+Run from the repository root:  python benchmarks/bench_sqlite_writes.py --students 300
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS attendance_records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        student_name TEXT NOT NULL
+    )
+"""
+INSERT = "INSERT INTO attendance_records (date, student_name) VALUES (?, ?)"
+
+
+def write_per_call(path, student, writes):
+    # Mirrors the original code: a fresh connection and rollback journal per write
+    errors = 0
+    for i in range(writes):
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute(INSERT, (f"2024-11-23 10:00:{i:02d}", student))
+            conn.commit()
+        except sqlite3.OperationalError:
+            errors += 1
+        finally:
+            conn.close()
+    return errors
+
+
+def write_pooled(path, student, writes):
+    errors = 0
+    for i in range(writes):
+        try:
+            db.execute(path, INSERT, (f"2024-11-23 10:00:{i:02d}", student))
+        except sqlite3.OperationalError:
+            errors += 1
+    return errors
+
+
+def run(label, writer, path, students, writes):
+    errors = []
+    threads = [
+        threading.Thread(target=lambda n=n: errors.append(writer(path, f"Student {n}", writes)))
+        for n in range(students)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    total = students * writes
+    print(f"{label:<22} {total / elapsed:>10.0f} writes/s  {elapsed:6.2f}s  lock errors: {sum(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=200, help="concurrent writer threads")
+    parser.add_argument("--writes", type=int, default=5, help="writes per student")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = os.path.join(tmp, "baseline.db")
+        conn = sqlite3.connect(baseline)
+        conn.execute(SCHEMA)
+        conn.close()
+        run("connect per call", write_per_call, baseline, args.students, args.writes)
+
+        pooled = os.path.join(tmp, "pooled.db")
+        db.ensure_schema(pooled, [SCHEMA])
+        run("pooled WAL", write_pooled, pooled, args.students, args.writes)
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
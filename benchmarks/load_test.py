@@ -0,0 +1,319 @@
+"""Load test: simulated classrooms driving the real pages headlessly against a mock Gemini and ipinfo.io.
+
+Run from the repository root:  python benchmarks/load_test.py --students 100 --concurrency 50 --llm-latency 0.5
+
+Every student logs in, opens Attendance and submits the teacher's code,
+draws MCQs on the Questions page and asks a question on the Reading Material
+page, each step a real rerun of machready.py through Streamlit's AppTest.
+A teacher session keeps generating codes and reading the attendance records
+meanwhile. Reported: p50/p95/p99 rerun latency per page and SQLite
+lock-wait counters per database file. Nothing leaves the machine.
+
+AppTest keeps its runtime in process globals, so each simulated session runs
+in its own process and the sessions meet in the shared SQLite files, as
+separate server processes would. Lock-wait counters are summed over them.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import google.generativeai as genai
+import requests
+from pptx import Presentation
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The app keeps its databases and uploads in the working directory, and some modules create tables on import.
+# Session processes re-import this module, so they find the directory through the environment.
+WORKDIR = os.environ.get("MACHREADY_LOAD_DIR") or tempfile.mkdtemp(prefix="machready-load-")
+os.environ["MACHREADY_LOAD_DIR"] = WORKDIR
+os.chdir(WORKDIR)
+
+import auth  # noqa: E402
+import codes  # noqa: E402
+import db  # noqa: E402
+import ingestion  # noqa: E402
+import materials  # noqa: E402
+import provision  # noqa: E402
+import question_bank  # noqa: E402
+import roster  # noqa: E402
+import tracing  # noqa: E402
+
+APP = os.path.join(ROOT, "machready.py")
+TEACHER_ID = "12345"
+PASSWORD = "load-test"
+SECRETS = {"API_KEY": "offline", "SESSION_SECRET": "load-test", "BCRYPT_ROUNDS": 4, "TIMEZONE_IP_LOOKUP": True}
+
+
+class MockResponse:
+    def __init__(self, text, prompt):
+        self.text = text
+        self.usage_metadata = types.SimpleNamespace(
+            prompt_token_count=len(str(prompt)) // 4, candidates_token_count=len(text) // 4
+        )
+
+
+class MockModel:
+    """Stands in for genai.GenerativeModel with a fixed time to first token and per-chunk delay."""
+
+    latency = 0.3
+    chunk_delay = 0.02
+
+    def __init__(self, model_name, generation_config=None, **kwargs):
+        self.model_name = model_name
+        self.generation_config = generation_config or {}
+
+    def _answer(self):
+        if self.generation_config.get("response_mime_type") == "application/json":
+            return json.dumps([
+                {"question": f"Question {n}?", "options": ["one", "two", "three", "four"], "answer": "B", "explanation": "Mock."}
+                for n in range(question_bank.QUESTIONS_PER_LEVEL)
+            ])
+        return "This is a mock answer [notes.pptx, slide 1]. " * 8
+
+    def generate_content(self, contents, stream=False):
+        time.sleep(self.latency)
+        text = self._answer()
+        if not stream:
+            return MockResponse(text, contents)
+        pieces = [text[i:i + 40] for i in range(0, len(text), 40)]
+
+        def chunks():
+            for piece in pieces:
+                time.sleep(self.chunk_delay)
+                yield MockResponse(piece, "")
+
+        return chunks()
+
+    def count_tokens(self, contents):
+        time.sleep(self.latency / 4)
+        return types.SimpleNamespace(total_tokens=len(str(contents)) // 4)
+
+
+def install_mocks(llm_latency, chunk_delay, ipinfo_latency):
+    MockModel.latency = llm_latency
+    MockModel.chunk_delay = chunk_delay
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = MockModel
+    real_get = requests.get
+
+    def fake_get(url, *args, **kwargs):
+        if "ipinfo.io" not in url:
+            return real_get(url, *args, **kwargs)
+        time.sleep(ipinfo_latency)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({"timezone": "Asia/Kolkata"}).encode()
+        return response
+
+    requests.get = fake_get
+
+
+def seed(students):
+    rows = [(1, {"user_id": TEACHER_ID, "password": PASSWORD, "role": "teacher"})]
+    rows += [(n + 2, {"user_id": str(n + 1), "password": PASSWORD, "role": "student"}) for n in range(students)]
+    provision.import_users(rows, batch_size=500, rounds=SECRETS["BCRYPT_ROUNDS"])
+    roster.enroll(("PEV112", "AB"[n % 2], str(n + 1), f"Student {n + 1}") for n in range(students))
+
+    deck = Presentation()
+    for n in range(20):
+        slide = deck.slides.add_slide(deck.slide_layouts[1])
+        slide.shapes.title.text = f"Topic {n}"
+        slide.placeholders[1].text = f"Mitochondria produce ATP through cellular respiration, step {n}. " * 20
+    data = io.BytesIO()
+    deck.save(data)
+    material, _ = materials.save_material("notes.pptx", data.getvalue())
+    ingestion.enqueue(material["sha256"])
+    question_bank.enqueue(material["sha256"])
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if not question_bank.banked_materials() or not ingestion.ready_materials():
+            time.sleep(0.2)
+            continue
+        if len(question_bank.banked_materials()[0]["difficulties"]) == len(question_bank.DIFFICULTIES):
+            return
+        time.sleep(0.2)
+    raise RuntimeError("Seed material was not ingested in time")
+
+
+class Session:
+    """One browser tab: an AppTest whose reruns are timed per page."""
+
+    def __init__(self, results):
+        self.at = AppTest.from_file(APP, default_timeout=300)
+        self.at.secrets.update(SECRETS)
+        self.results = results
+
+    def run(self, page, widget=None):
+        started = time.perf_counter()
+        (widget.run() if widget is not None else self.at.run())
+        elapsed = time.perf_counter() - started
+        error = self.at.exception[0].value if self.at.exception else None
+        self.results.append((page, elapsed, error))
+        return error is None
+
+    def login(self, user_id):
+        self.run("login_page")
+        self.at.text_input[0].set_value(user_id)
+        self.at.text_input[1].set_value(PASSWORD)
+        self.run("login_page (submit)", self.at.button[0].click())
+        return self.at.session_state["logged_in"]
+
+    def open(self, page):
+        self.at.sidebar.selectbox[0].set_value(page)
+
+    def button(self, label):
+        return next(b for b in self.at.button if b.label == label)
+
+
+def start_session_process(llm_latency, chunk_delay, ipinfo_latency):
+    install_mocks(llm_latency, chunk_delay, ipinfo_latency)
+
+
+def student_visit(user_id, code):
+    """Runs in its own process; returns the timed reruns and that process's counters."""
+    results = []
+    try:
+        _student_visit(user_id, code, results)
+    except Exception as e:
+        # A page that failed to render leaves nothing to click; count it and move on
+        results.append(("student visit aborted", 0.0, f"{e.__class__.__name__}: {e}"))
+    return results, db.lock_stats(), tracing.slowest_operations(limit=10)
+
+
+def _student_visit(user_id, code, results):
+    tab = Session(results)
+    if not tab.login(user_id):
+        results.append(("login failed", 0.0, "not logged in"))
+        return
+    tab.run("student_dashboard")
+    # Skip the three-minute wait before the code box appears
+    tab.at.session_state["login_time"] = tab.at.session_state["login_time"] - timedelta(minutes=4)
+
+    tab.open("Attendance")
+    tab.run("Attendance")
+    tab.at.text_input[0].set_value(code)
+    tab.run("Attendance (submit code)", tab.button("Submit Code").click())
+
+    tab.open("Questions")
+    tab.run("questions_page")
+    tab.run("questions_page (generate MCQs)", tab.button("Generate MCQs").click())
+
+    tab.open("Reading Material")
+    tab.run("reading_material_page")
+    tab.run("reading_material_page (library)", tab.at.radio[0].set_value("Course Library"))
+    tab.at.text_input[0].set_value(f"How do mitochondria produce ATP? (student {user_id})")
+    tab.run("reading_material_page (ask)")
+
+
+def teacher_loop(mocks, stop, out):
+    start_session_process(*mocks)
+    results = []
+    tab = Session(results)
+    tab.login(TEACHER_ID)
+    tab.run("professor_dashboard")
+    while not stop.is_set():
+        if not tab.run("professor_dashboard (generate code)", tab.button("Generate Code").click()):
+            # The page didn't finish rendering; reload it before clicking again
+            tab.run("professor_dashboard")
+            continue
+        tab.run("professor_dashboard (attendance records)", tab.button("Show Attendance Records").click())
+        time.sleep(1)
+    out.put((results, db.lock_stats(), tracing.slowest_operations(limit=10)))
+
+
+def percentile(values, p):
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1] if len(values) > 1 else values[0]
+
+
+def report(results, lock_stats, operations, elapsed):
+    pages = {}
+    errors = {}
+    for page, seconds, error in results:
+        pages.setdefault(page, []).append((seconds, error))
+        if error:
+            errors.setdefault(error, page)
+    print(f"\n{'page':<42} {'runs':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for page, runs in pages.items():
+        times = sorted(seconds for seconds, _ in runs)
+        print(
+            f"{page:<42} {len(runs):>5} {percentile(times, 50) * 1000:>9.0f} {percentile(times, 95) * 1000:>9.0f}"
+            f" {percentile(times, 99) * 1000:>9.0f} {sum(1 for _, error in runs if error):>7}"
+        )
+    for error, page in errors.items():
+        print(f"  error on {page}: {error}")
+    print(f"\n{len(results)} reruns in {elapsed:.1f}s ({len(results) / elapsed:.1f} reruns/s)")
+    print(f"\n{'database':<22} {'writes':>7} {'lock waits':>11} {'wait s':>8} {'busy errors':>12} {'pool waits':>11}")
+    for path, stats in sorted(lock_stats.items()):
+        print(
+            f"{path:<22} {stats['transactions']:>7} {stats['lock_waits']:>11} {stats['lock_wait_seconds']:>8.2f}"
+            f" {stats['busy_errors']:>12} {stats['pool_waits']:>11}"
+        )
+    print(f"\n{'slowest operations':<42} {'ms':>9}  page")
+    for op in sorted(operations, key=lambda op: op["ms"], reverse=True)[:10]:
+        print(f"{op['kind'] + ' ' + op['name']:<42} {op['ms']:>9.0f}  {op['page']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50, help="student sessions running at once")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="mock Gemini time to first token (s)")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="mock Gemini delay between streamed chunks (s)")
+    parser.add_argument("--ipinfo-latency", type=float, default=0.2, help="mock ipinfo.io response time (s)")
+    args = parser.parse_args()
+
+    mocks = (args.llm_latency, args.chunk_delay, args.ipinfo_latency)
+    install_mocks(*mocks)
+    try:
+        auth.configure(secret=SECRETS["SESSION_SECRET"], rounds=SECRETS["BCRYPT_ROUNDS"])
+        seed(args.students)
+        code, _ = codes.generate_code()
+        # Release the seed's connections before the session processes open theirs
+        db.close_all()
+
+        # Fresh interpreters, so no session inherits the seed's threads or connections
+        context = multiprocessing.get_context("spawn")
+        stop = context.Event()
+        out = context.Queue()
+        teacher = context.Process(target=teacher_loop, args=(mocks, stop, out), daemon=True)
+        teacher.start()
+        started = time.perf_counter()
+        # One process per student visit, several at once
+        with ProcessPoolExecutor(
+            max_workers=args.concurrency, mp_context=context, initializer=start_session_process,
+            initargs=mocks, max_tasks_per_child=1,
+        ) as pool:
+            visits = list(pool.map(student_visit, [str(n + 1) for n in range(args.students)], [code] * args.students))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        visits.append(out.get())
+        teacher.join()
+
+        results, lock_stats, operations = [], {}, []
+        for visit_results, visit_stats, visit_operations in visits:
+            results += visit_results
+            operations += visit_operations
+            for path, stats in visit_stats.items():
+                totals = lock_stats.setdefault(path, dict.fromkeys(stats, 0))
+                for key, value in stats.items():
+                    totals[key] += value
+        report(results, lock_stats, operations, elapsed)
+    finally:
+        db.close_all()
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""Attendance as one bitset per (course, session day); bit i is the student at roster position i.
+
+    python bitsets.py rebuild
+    python bitsets.py export term.parquet --course PEV112 --start 2024-08-01 --end 2024-12-20
+
+attendance_records remains the log of who was marked in which course and when.
+The bitsets are updated in the same transaction as every write, and hold a session of a
+1,500-student course in under 200 bytes, so term-wide set operations and
+exports read a few kilobytes instead of every record. ``rebuild`` recomputes
+them from the records, so it only sets a student's bit in the course they were
+marked in; it is also the migration for databases that predate them.
+"""
+import argparse
+import io
+import json
+import sys
+import threading
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import db
+import roster
+
+BITSETS_DB = db.ATTENDANCE_DB
+# Matches a roster row whose student takes no other course
+_ONLY_COURSE = "NOT EXISTS (SELECT 1 FROM roster other WHERE other.student_id = roster.student_id AND other.course <> roster.course)"
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def init_bitsets_db():
+    """Create the bitset table, filling it from the existing records if it is empty."""
+    global _schema_ready
+    roster.init_roster_db()
+    with _schema_lock:
+        if _schema_ready:
+            return
+        db.ensure_schema(BITSETS_DB, ["""
+            CREATE TABLE IF NOT EXISTS attendance_bitsets (
+                course TEXT NOT NULL,
+                day TEXT NOT NULL,
+                bits BLOB NOT NULL,  -- little-endian: byte 0 holds positions 0-7
+                present INTEGER NOT NULL,
+                PRIMARY KEY (course, day)
+            ) WITHOUT ROWID
+        """])
+        with db.connection(BITSETS_DB) as conn:
+            has_records = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attendance_records'").fetchone()
+            empty = not conn.execute("SELECT 1 FROM attendance_bitsets LIMIT 1").fetchone()
+        if not has_records:
+            # attendance.init_attendance_db() calls back once the records it migrates from exist
+            return
+        _schema_ready = True
+    if empty:
+        rebuild()
+
+
+def encode(value):
+    return value.to_bytes((value.bit_length() + 7) // 8, "little")
+
+
+def decode(bits):
+    return int.from_bytes(bits or b"", "little")
+
+
+def from_positions(positions):
+    positions = np.asarray(list(positions), dtype=np.int64)
+    if not positions.size:
+        return 0
+    flags = np.zeros(int(positions.max()) + 1, dtype=bool)
+    flags[positions] = True
+    return decode(np.packbits(flags, bitorder="little").tobytes())
+
+
+def to_positions(value):
+    flags = np.unpackbits(np.frombuffer(encode(value), dtype=np.uint8), bitorder="little")
+    return np.flatnonzero(flags).tolist()
+
+
+def _flags(value, size):
+    # One bool per roster position, for vectorized lookups
+    flags = np.unpackbits(np.frombuffer(encode(value), dtype=np.uint8), bitorder="little")[:size]
+    return np.pad(flags, (0, size - len(flags))).astype(bool)
+
+
+def _write(conn, course, day, value):
+    conn.execute(
+        """
+        INSERT INTO attendance_bitsets (course, day, bits, present) VALUES (?, ?, ?, ?)
+        ON CONFLICT (course, day) DO UPDATE SET bits = excluded.bits, present = excluded.present
+        """,
+        (course, day, encode(value), value.bit_count()),
+    )
+
+
+def mark(conn, day, course_positions):
+    """Set the bits for (course, position) pairs on a day, inside the caller's transaction."""
+    by_course = {}
+    for course, position in course_positions:
+        by_course.setdefault(course, []).append(position)
+    for course, positions in by_course.items():
+        row = conn.execute("SELECT bits FROM attendance_bitsets WHERE course = ? AND day = ?", (course, day)).fetchone()
+        _write(conn, course, day, decode(row[0] if row else None) | from_positions(positions))
+
+
+def mark_students(conn, day, student_ids):
+    """Set the bits on a day of students marked without a course.
+
+    Only a student enrolled in exactly one course can be placed; anyone
+    else's session is unknown, so none of their courses is marked.
+    """
+    rows = conn.execute(
+        f"""
+        SELECT course, position FROM roster
+        WHERE student_id IN (SELECT value FROM json_each(?)) AND {_ONLY_COURSE}
+        """,
+        (json.dumps(list(student_ids)),),
+    ).fetchall()
+    mark(conn, day, rows)
+
+
+def rebuild(course=None):
+    """Recompute the bitsets (of one course, or all) from attendance_records; returns how many were written.
+
+    Each record sets the student's bit in its own course. Records without a
+    course count the way mark_students does.
+    """
+    roster.init_roster_db()
+    with db.transaction(BITSETS_DB) as conn:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attendance_records'").fetchone():
+            return 0
+        scope = "AND roster.course = ?" if course else ""
+        conn.execute(f"DELETE FROM attendance_bitsets {'WHERE course = ?' if course else ''}", (course,) if course else ())
+        rows = conn.execute(
+            f"""
+            SELECT DISTINCT a.date, roster.course, roster.position FROM attendance_records a
+            JOIN roster ON roster.student_id = a.student_name
+            WHERE (roster.course = a.course OR (a.course = '' AND {_ONLY_COURSE}))
+            {scope}
+            ORDER BY a.date, roster.course
+            """,
+            (course,) if course else (),
+        ).fetchall()
+        sessions = {}
+        for day, session_course, position in rows:
+            sessions.setdefault((session_course, day), []).append(position)
+        for (session_course, day), positions in sessions.items():
+            _write(conn, session_course, day, from_positions(positions))
+        return len(sessions)
+
+
+def session(course, day):
+    """The bitset of students present in a course on a day (0 if nobody was marked)."""
+    init_bitsets_db()
+    row = db.query_one(BITSETS_DB, "SELECT bits FROM attendance_bitsets WHERE course = ? AND day = ?", (course, day))
+    return decode(row[0] if row else None)
+
+
+def sessions(course, start=None, end=None):
+    """[(day, bitset)] for a course's session days between start and end (inclusive), oldest first."""
+    init_bitsets_db()
+    rows = db.query(
+        BITSETS_DB,
+        "SELECT day, bits FROM attendance_bitsets WHERE course = ? AND day >= ? AND day <= ? ORDER BY day",
+        (course, start or "", end or roster.PREFIX_END),
+    )
+    return [(day, decode(bits)) for day, bits in rows]
+
+
+def enrolled(course, section=None):
+    """The bitset of everyone enrolled in a course (or one section)."""
+    return from_positions(position for position, _, _, student_section in roster.positions(course) if section is None or student_section == section)
+
+
+def absent(course, day, section=None):
+    return enrolled(course, section) & ~session(course, day)
+
+
+def present_at_all(course, days):
+    """Students present at every one of the given session days."""
+    result = enrolled(course)
+    for day in days:
+        result &= session(course, day)
+    return result
+
+
+def present_at_any(course, days):
+    result = 0
+    for day in days:
+        result |= session(course, day)
+    return result
+
+
+def absent_from_all(course, days, section=None):
+    return enrolled(course, section) & ~present_at_any(course, days)
+
+
+def students(course, value):
+    """(student_id, name) for each bit set in a bitset of this course."""
+    wanted = set(to_positions(value))
+    return [(student_id, name) for position, student_id, name, _ in roster.positions(course) if position in wanted]
+
+
+def term_table(course=None, start=None, end=None):
+    """Attendance as an Arrow table, one row per enrolled student per session day.
+
+    Columns: course, day, student_id, name, section, present. Each session is
+    expanded from its bitset with numpy, so the cost is one pass over the
+    bytes rather than a query per student.
+    """
+    init_bitsets_db()
+    batches = []
+    for name in [course] if course else roster.courses():
+        enrolments = roster.positions(name)
+        days = sessions(name, start, end)
+        if not enrolments or not days:
+            continue
+        positions = np.array([row[0] for row in enrolments], dtype=np.int64)
+        size = int(positions.max()) + 1
+        present = np.concatenate([_flags(value, size)[positions] for _, value in days])
+        batches.append(pa.record_batch({
+            "course": pa.array([name] * len(present)),
+            "day": pa.array(np.repeat([day for day, _ in days], len(enrolments))),
+            "student_id": pa.array([row[1] for row in enrolments] * len(days)),
+            "name": pa.array([row[2] for row in enrolments] * len(days)),
+            "section": pa.array([row[3] for row in enrolments] * len(days)),
+            "present": pa.array(present),
+        }))
+    schema = pa.schema([("course", pa.string()), ("day", pa.string()), ("student_id", pa.string()), ("name", pa.string()), ("section", pa.string()), ("present", pa.bool_())])
+    return pa.Table.from_batches(batches, schema=schema)
+
+
+def export_parquet(course=None, start=None, end=None, path=None):
+    """Write the term table as Parquet to path, or return the file's bytes when no path is given."""
+    table = term_table(course, start, end)
+    target = path or io.BytesIO()
+    pq.write_table(table, target, compression="zstd")
+    return None if path else target.getvalue()
+
+
+def export_arrow(course=None, start=None, end=None):
+    """The term table as Arrow IPC (Feather v2) bytes."""
+    table = term_table(course, start, end)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild attendance bitsets or export them for term analytics.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = commands.add_parser("rebuild", help="recompute bitsets from attendance_records")
+    rebuild_parser.add_argument("--course")
+    export_parser = commands.add_parser("export", help="write a .parquet or .arrow file")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--course")
+    export_parser.add_argument("--start", help="first day, YYYY-MM-DD")
+    export_parser.add_argument("--end", help="last day, YYYY-MM-DD")
+    args = parser.parse_args()
+
+    # The bitsets are built from the attendance records, so their schema must be current first
+    import attendance
+    attendance.init_attendance_db()
+    if args.command == "rebuild":
+        print(f"Rebuilt {rebuild(args.course)} session bitsets.")
+    elif args.path.endswith((".arrow", ".feather")):
+        with open(args.path, "wb") as f:
+            f.write(export_arrow(args.course, args.start, args.end))
+    else:
+        export_parquet(args.course, args.start, args.end, path=args.path)
+    db.close_all()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
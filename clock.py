@@ -0,0 +1,26 @@
+import os
+import time
+
+import streamlit.components.v1 as components
+
+# Served by Streamlit from this directory; the browser fetches it once and keeps the iframe across reruns
+COMPONENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "clock")
+
+_session_clock = components.declare_component("session_clock", path=COMPONENT_DIR)
+
+
+def session_clock(login_time=None, warn_on_tab_switch=True, key="session_clock"):
+    """Show the local time and the time since login, ticking in the browser.
+
+    Call it from the same place on every rerun (e.g. the sidebar) with the same
+    key so Streamlit keeps the one iframe mounted instead of reloading it. The
+    browser's own clock and timezone drive the display; the server only sends
+    the login time and its current time, to correct for a skewed client clock.
+    """
+    return _session_clock(
+        login_time_ms=int(login_time.timestamp() * 1000) if login_time else None,
+        server_time_ms=int(time.time() * 1000),
+        warn_on_tab_switch=warn_on_tab_switch,
+        key=key,
+        default=None,
+    )
@@ -0,0 +1,160 @@
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+import db
+import tracing
+
+# How long a generated code stays valid
+CODE_LIFETIME = timedelta(minutes=6)
+# Unknown codes trigger at most one reload of the live codes per interval
+RELOAD_INTERVAL = 1.0
+# Expired codes are deleted from SQLite this often
+PURGE_INTERVAL = 60
+# Code submissions allowed per user within the window
+MAX_ATTEMPTS = 5
+ATTEMPT_WINDOW = 60
+
+_live_codes = {}
+_last_reload = 0.0
+_lock = threading.Lock()
+_attempts = {}
+_attempts_lock = threading.Lock()
+_purger = None
+_schema_ready = False
+
+
+def init_codes_db():
+    """Create the codes table, add the newer columns to older databases and start the purger."""
+    global _schema_ready
+    with _lock:
+        if _schema_ready:
+            return
+        with db.transaction(db.CODES_DB) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS codes (
+                    code TEXT PRIMARY KEY,
+                    expiration_time TEXT NOT NULL,
+                    expires_at INTEGER,
+                    course TEXT,  -- the class the code marks attendance for; NULL for any
+                    section TEXT
+                )
+            """)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(codes)")]
+            for column, kind in (("expires_at", "INTEGER"), ("course", "TEXT"), ("section", "TEXT")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE codes ADD COLUMN {column} {kind}")
+            # expiration_time was written in server local time
+            conn.execute("""
+                UPDATE codes SET expires_at = CAST(strftime('%s', expiration_time, 'utc') AS INTEGER)
+                WHERE expires_at IS NULL
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_codes_expires_at ON codes (expires_at)")
+        _schema_ready = True
+    _reload(force=True)
+    _start_purger()
+
+
+def _reload(force=False):
+    """Replace the in-memory map with the live codes in SQLite, at most once per RELOAD_INTERVAL."""
+    global _live_codes, _last_reload
+    now = time.time()
+    with _lock:
+        if not force and now - _last_reload < RELOAD_INTERVAL:
+            return False
+        _last_reload = now
+    rows = db.query(db.CODES_DB, "SELECT code, expires_at, course, section FROM codes WHERE expires_at > ?", (int(now),))
+    with _lock:
+        _live_codes = {code: (expires_at, course, section) for code, expires_at, course, section in rows}
+    return True
+
+
+def generate_code(course=None, section=None):
+    """Create a new attendance code for a course (and section); returns (code, expiration datetime)."""
+    init_codes_db()
+    code = str(uuid.uuid4())[:8]  # Generate a unique code (8 characters)
+    expiration_time = datetime.now() + CODE_LIFETIME
+    expires_at = int(expiration_time.timestamp())
+    db.execute(
+        db.CODES_DB,
+        "INSERT INTO codes (code, expiration_time, expires_at, course, section) VALUES (?, ?, ?, ?, ?)",
+        (code, expiration_time.strftime("%Y-%m-%d %H:%M:%S"), expires_at, course, section),
+    )
+    with _lock:
+        _live_codes[code] = (expires_at, course, section)
+    return code, expiration_time
+
+
+def lookup(code):
+    """Return (course, section) of a live code, or None if it doesn't exist or has expired.
+
+    Answers come from the in-memory map. A code this process has not seen
+    (e.g. generated by another worker) triggers a rate-limited reload from
+    SQLite, so a flood of wrong guesses cannot turn into a flood of queries.
+    """
+    init_codes_db()
+    code = (code or "").strip()
+    if not code:
+        return None
+    now = time.time()
+    with _lock:
+        live = _live_codes.get(code)
+    if live is None and _reload():
+        with _lock:
+            live = _live_codes.get(code)
+    if live is None or now > live[0]:
+        return None
+    return live[1], live[2]
+
+
+def validate_code(code):
+    """Return True if the code exists and has not expired."""
+    return lookup(code) is not None
+
+
+def allow_attempt(user_id):
+    """Sliding-window limit on code submissions; returns seconds to wait, or 0 if allowed."""
+    now = time.monotonic()
+    with _attempts_lock:
+        attempts = _attempts.setdefault(user_id, deque())
+        while attempts and now - attempts[0] > ATTEMPT_WINDOW:
+            attempts.popleft()
+        if len(attempts) >= MAX_ATTEMPTS:
+            return int(ATTEMPT_WINDOW - (now - attempts[0])) + 1
+        attempts.append(now)
+        return 0
+
+
+def purge_expired():
+    """Delete expired codes from SQLite and memory; returns the number of rows removed."""
+    now = int(time.time())
+    removed = db.execute(db.CODES_DB, "DELETE FROM codes WHERE expires_at <= ?", (now,))
+    with _lock:
+        for code in [code for code, live in _live_codes.items() if live[0] <= now]:
+            del _live_codes[code]
+    with _attempts_lock:
+        for user_id in [u for u, a in _attempts.items() if not a or time.monotonic() - a[-1] > ATTEMPT_WINDOW]:
+            del _attempts[user_id]
+    return removed
+
+
+def _purge_loop():
+    while True:
+        time.sleep(PURGE_INTERVAL)
+        with tracing.trace("code_purge", kind="job"), tracing.span("codes", "purge expired") as details:
+            try:
+                details["removed"] = purge_expired()
+            except Exception as e:
+                # Lands in the request log; the next pass tries again
+                details["error"] = f"{e.__class__.__name__}: {e}"
+
+
+def _start_purger():
+    global _purger
+    with _lock:
+        if _purger is not None:
+            return
+        _purger = threading.Thread(target=_purge_loop, name="code-purger", daemon=True)
+    _purger.start()
@@ -0,0 +1,312 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import tracing
+
+USERS_DB = "users.db"
+ATTENDANCE_DB = "attendance.db"
+CODES_DB = "codes.db"
+MATERIALS_DB = "shared_materials.db"
+
+# Connections kept open per database file
+POOL_SIZE = 8
+# How long a writer waits for the lock before SQLite gives up
+BUSY_TIMEOUT_MS = 5000
+# Compiled statements kept per connection; pooled connections reuse them across reruns
+STATEMENT_CACHE_SIZE = 256
+# BEGIN IMMEDIATE taking longer than this means the writer queued behind another one
+LOCK_WAIT_THRESHOLD = 0.005
+# Group commit: writes queued within this long of the first one share its transaction
+GROUP_COMMIT_WINDOW = 0.005
+GROUP_COMMIT_MAX_BATCH = 500
+
+
+class ConnectionPool:
+    """A bounded set of WAL-mode connections to one SQLite file, shared by all sessions."""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        # Every connection is in use; wait for one to come back
+        _count(self.path, "pool_waits")
+        return self._idle.get(timeout=BUSY_TIMEOUT_MS / 1000)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+class GroupCommitWriter:
+    """A thread that applies queued writes to one database file, many per transaction.
+
+    A burst of small writes (a whole class submitting an attendance code) would
+    otherwise queue for the write lock one commit at a time. ``submit`` returns
+    a Future that resolves to the write's result once its transaction has
+    committed. Each write runs in its own savepoint, so one failing write fails
+    only its own Future.
+    """
+
+    def __init__(self, path, window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX_BATCH):
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"group-commit-{path}", daemon=True)
+        self._thread.start()
+
+    def submit(self, write):
+        """Queue write(conn) to run inside a shared transaction; returns a Future."""
+        future = Future()
+        self._queue.put((write, future))
+        return future
+
+    def close(self):
+        """Commit what is already queued and stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            stopping = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            _count(self.path, "group_commits")
+            _count(self.path, "group_committed_writes", len(batch))
+            if stopping:
+                return
+
+    def _commit(self, batch):
+        pending = [(write, future) for write, future in batch if future.set_running_or_notify_cancel()]
+        outcomes = []
+        try:
+            with transaction(self.path) as conn:
+                for write, future in pending:
+                    conn.execute("SAVEPOINT group_write")
+                    try:
+                        outcomes.append((future, write(conn), None))
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO group_write")
+                        outcomes.append((future, None, e))
+                    conn.execute("RELEASE group_write")
+        except Exception as e:
+            # Nothing was committed
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_writers = {}
+# Per database file: write transactions, how many waited for the write lock and for how long
+_lock_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _count(path, counter, amount=1):
+    with _stats_lock:
+        stats = _lock_stats.setdefault(
+            path,
+            {
+                "transactions": 0, "lock_waits": 0, "lock_wait_seconds": 0.0, "busy_errors": 0, "pool_waits": 0,
+                "group_commits": 0, "group_committed_writes": 0,
+            },
+        )
+        stats[counter] += amount
+
+
+def lock_stats():
+    """Contention counters per database file since start-up (or the last reset)."""
+    with _stats_lock:
+        return {path: dict(stats) for path, stats in _lock_stats.items()}
+
+
+def reset_lock_stats():
+    with _stats_lock:
+        _lock_stats.clear()
+
+
+def get_pool(path):
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+        return pool
+
+
+def writer(path):
+    """The shared group-commit writer for a database file, started on first use."""
+    with _pools_lock:
+        group_writer = _writers.get(path)
+        if group_writer is None:
+            group_writer = _writers[path] = GroupCommitWriter(path)
+        return group_writer
+
+
+def close_all():
+    with _pools_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for group_writer in writers:
+        group_writer.close()
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+@contextmanager
+def connection(path):
+    """Borrow a pooled connection; any transaction left open is rolled back on return."""
+    with tracing.span("db", os.path.basename(path)):
+        pool = get_pool(path)
+        conn = pool.acquire()
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
+
+
+@contextmanager
+def transaction(path):
+    """Borrow a connection and run the block in one write transaction.
+
+    BEGIN IMMEDIATE takes the write lock up front, so concurrent writers wait
+    on busy_timeout instead of failing halfway through with "database is locked".
+    """
+    with connection(path) as conn:
+        started = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            # busy_timeout ran out
+            _count(path, "busy_errors")
+            raise
+        waited = time.perf_counter() - started
+        tracing.annotate(write=True, lock_wait_ms=round(waited * 1000, 2))
+        _count(path, "transactions")
+        if waited > LOCK_WAIT_THRESHOLD:
+            _count(path, "lock_waits")
+            _count(path, "lock_wait_seconds", waited)
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def query(path, sql, params=()):
+    with connection(path) as conn:
+        tracing.annotate(sql=tracing.sql_preview(sql))
+        return conn.execute(sql, params).fetchall()
+
+
+def query_one(path, sql, params=()):
+    with connection(path) as conn:
+        tracing.annotate(sql=tracing.sql_preview(sql))
+        return conn.execute(sql, params).fetchone()
+
+
+def stream(path, sql, params=(), batch_size=1000):
+    """Yield the result in lists of at most batch_size rows, never holding more than one batch.
+
+    The connection (and its read snapshot) is kept until the generator is
+    exhausted or closed.
+    """
+    with connection(path) as conn:
+        tracing.annotate(sql=tracing.sql_preview(sql))
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+
+def execute(path, sql, params=()):
+    """Run one write statement in its own transaction and return the affected row count."""
+    with transaction(path) as conn:
+        tracing.annotate(sql=tracing.sql_preview(sql))
+        return conn.execute(sql, params).rowcount
+
+
+def executemany(path, sql, rows):
+    with transaction(path) as conn:
+        tracing.annotate(sql=tracing.sql_preview(sql))
+        return conn.executemany(sql, rows).rowcount
+
+
+def ensure_schema(path, statements):
+    with transaction(path) as conn:
+        for statement in statements:
+            conn.execute(statement)
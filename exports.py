@@ -0,0 +1,161 @@
+"""Streaming CSV/Parquet exports of attendance records and the materials catalog.
+
+    python exports.py attendance attendance.csv --start 2024-08-01 --end 2024-12-20 --student 1234
+    python exports.py materials materials.parquet
+
+Rows are read from the cursor BATCH_SIZE at a time and written straight to the
+output, so memory stays flat however large the table is.
+"""
+import argparse
+import csv
+import io
+import sys
+from datetime import date, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import attendance
+import db
+import materials
+
+# Rows fetched per round trip; also the Parquet row-group size
+BATCH_SIZE = 5000
+FORMATS = ("csv", "parquet")
+MIME_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+DATASETS = {
+    "attendance": {
+        "db": db.ATTENDANCE_DB,
+        "init": attendance.init_attendance_db,
+        "select": "SELECT date, time, course, student_name FROM attendance_records",
+        "columns": [("date", pa.string()), ("time", pa.string()), ("course", pa.string()), ("student_id", pa.string())],
+        # Both are indexed, so a filtered export reads only the matching rows
+        "date_column": "date",
+        "student_column": "student_name",
+        "order": "date, id",
+    },
+    "materials": {
+        "db": db.MATERIALS_DB,
+        "init": materials.init_materials_db,
+        "select": "SELECT id, filename, upload_time, sha256, size, mime_type FROM materials",
+        "columns": [
+            ("id", pa.int64()), ("filename", pa.string()), ("upload_time", pa.string()),
+            ("sha256", pa.string()), ("size", pa.int64()), ("mime_type", pa.string()),
+        ],
+        "date_column": "upload_time",
+        "student_column": None,
+        "order": "upload_time, id",
+    },
+}
+
+
+def _day(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def build_query(dataset, start=None, end=None, student=None):
+    """SQL and parameters for a dataset filtered by an inclusive day range and (for attendance) a student."""
+    spec = DATASETS[dataset]
+    clauses = []
+    params = []
+    if start:
+        clauses.append(f"{spec['date_column']} >= ?")
+        params.append(_day(start).isoformat())
+    if end:
+        # upload_time carries a time of day, so compare against the start of the next day
+        clauses.append(f"{spec['date_column']} < ?")
+        params.append((_day(end) + timedelta(days=1)).isoformat())
+    if student:
+        if not spec["student_column"]:
+            raise ValueError(f"The {dataset} export can't be filtered by student.")
+        clauses.append(f"{spec['student_column']} = ?")
+        params.append(student)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return f"{spec['select']} {where} ORDER BY {spec['order']}", params
+
+
+def batches(dataset, start=None, end=None, student=None, batch_size=BATCH_SIZE):
+    spec = DATASETS[dataset]
+    spec["init"]()
+    sql, params = build_query(dataset, start, end, student)
+    return db.stream(spec["db"], sql, params, batch_size)
+
+
+def write_csv(row_batches, columns, out):
+    """Write batches of rows to a binary file object as UTF-8 CSV; returns the row count."""
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    writer.writerow([name for name, _ in columns])
+    count = 0
+    for rows in row_batches:
+        writer.writerows(rows)
+        count += len(rows)
+    # Hand the stream back to the caller open
+    text.detach()
+    return count
+
+
+def write_parquet(row_batches, columns, out):
+    """Write batches of rows to a binary file object as Parquet, one row group per batch; returns the row count."""
+    schema = pa.schema(columns)
+    count = 0
+    with pq.ParquetWriter(out, schema, compression="zstd") as writer:
+        for rows in row_batches:
+            values = list(zip(*rows))
+            writer.write_batch(pa.record_batch([pa.array(column, type=kind) for column, (_, kind) in zip(values, columns)], schema=schema))
+            count += len(rows)
+    return count
+
+
+def export(dataset, fmt, out, start=None, end=None, student=None, batch_size=BATCH_SIZE):
+    """Stream a dataset into ``out`` (a path or binary file object); returns the number of rows written."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    write = write_csv if fmt == "csv" else write_parquet
+    row_batches = batches(dataset, start, end, student, batch_size)
+    try:
+        if isinstance(out, str):
+            with open(out, "wb") as f:
+                return write(row_batches, DATASETS[dataset]["columns"], f)
+        return write(row_batches, DATASETS[dataset]["columns"], out)
+    finally:
+        # Returns the pooled connection even if writing failed halfway
+        row_batches.close()
+
+
+def export_bytes(dataset, fmt, start=None, end=None, student=None):
+    """The export as bytes, for a download button."""
+    out = io.BytesIO()
+    export(dataset, fmt, out, start, end, student)
+    return out.getvalue()
+
+
+def file_name(dataset, fmt, start=None, end=None, student=None):
+    parts = [dataset]
+    if student:
+        parts.append(student)
+    if start or end:
+        parts.append(f"{_day(start).isoformat() if start else 'start'}_to_{_day(end).isoformat() if end else 'today'}")
+    return f"{'-'.join(parts)}.{fmt}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export attendance records or the materials catalog to CSV or Parquet.")
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("path", help="output file; the format follows the extension (.csv or .parquet)")
+    parser.add_argument("--start", help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", help="last day, YYYY-MM-DD")
+    parser.add_argument("--student", help="student ID (attendance only)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    fmt = "parquet" if args.path.endswith(".parquet") else "csv"
+    count = export(args.dataset, fmt, args.path, args.start, args.end, args.student, args.batch_size)
+    print(f"Exported {count} rows to {args.path}.")
+    db.close_all()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from PyPDF2 import PdfReader
+from pptx import Presentation
+
+import db
+import tracing
+
+# On-disk tier shared by every session and kept across restarts
+CACHE_DB = "extraction_cache.db"
+# Number of documents kept in the in-memory tier
+MEMORY_CACHE_SIZE = 64
+
+PDF_TYPES = ["application/pdf"]
+PPT_TYPES = ["application/vnd.ms-powerpoint", "application/vnd.openxmlformats-officedocument.presentationml.presentation"]
+
+_memory_cache = OrderedDict()
+_lock = threading.Lock()
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+
+def content_hash(data):
+    """Return the SHA-256 hex digest used as the cache key for a document."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def kind_for_mime(mime_type):
+    if mime_type in PDF_TYPES:
+        return "pdf"
+    if mime_type in PPT_TYPES:
+        return "pptx"
+    return None
+
+
+def init_cache_db():
+    db.ensure_schema(CACHE_DB, ["""
+        CREATE TABLE IF NOT EXISTS extracted_text (
+            sha256 TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            pages TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (sha256, kind)
+        )
+    """])
+
+
+def _parse_pdf(data):
+    reader = PdfReader(io.BytesIO(data))
+    return [page.extract_text() or "" for page in reader.pages]
+
+
+def _parse_pptx(data):
+    presentation = Presentation(io.BytesIO(data))
+    slides = []
+    for slide in presentation.slides:
+        texts = [shape.text for shape in slide.shapes if hasattr(shape, "text")]
+        slides.append("\n".join(texts).strip())
+    return slides
+
+
+def _remember(key, pages):
+    # Caller must hold _lock
+    _memory_cache[key] = pages
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache) > MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+
+def _load_from_disk(key):
+    row = db.query_one(CACHE_DB, "SELECT pages FROM extracted_text WHERE sha256 = ? AND kind = ?", key)
+    return json.loads(row[0]) if row else None
+
+
+def _store_on_disk(key, pages):
+    db.execute(
+        CACHE_DB,
+        "INSERT OR REPLACE INTO extracted_text (sha256, kind, pages, created_at) VALUES (?, ?, ?, ?)",
+        (key[0], key[1], json.dumps(pages), datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+    )
+
+
+def extract_pages(data, kind, digest=None):
+    """Return the text of every page (PDF) or slide (PPTX) in the document.
+
+    Results are cached by the SHA-256 of the file bytes, first in a bounded
+    in-memory LRU and then in SQLite, so reruns and re-uploads skip parsing.
+    """
+    key = (digest or content_hash(data), kind)
+    with _lock:
+        if key in _memory_cache:
+            _memory_cache.move_to_end(key)
+            _stats["memory_hits"] += 1
+            return _memory_cache[key]
+
+    pages = _load_from_disk(key)
+    if pages is not None:
+        with _lock:
+            _stats["disk_hits"] += 1
+            _remember(key, pages)
+        return pages
+
+    if kind not in ("pdf", "pptx"):
+        raise ValueError(f"Unsupported document type: {kind}")
+    with tracing.span("parse", kind, bytes=len(data)):
+        pages = _parse_pdf(data) if kind == "pdf" else _parse_pptx(data)
+
+    _store_on_disk(key, pages)
+    with _lock:
+        _stats["misses"] += 1
+        _remember(key, pages)
+    return pages
+
+
+def extract_text(data, kind, digest=None):
+    """Return the whole document as a single string."""
+    return "\n".join(extract_pages(data, kind, digest)).strip()
+
+
+def cache_stats():
+    """Return hit/miss counters and the overall hit rate of the extraction cache."""
+    with _lock:
+        stats = dict(_stats)
+        stats["memory_entries"] = len(_memory_cache)
+    lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+    return stats
+
+
+init_cache_db()
@@ -0,0 +1,212 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import db
+import extraction
+import materials
+import retrieval
+import search
+import tracing
+
+# Documents parsed at the same time; parsing is CPU heavy, so keep this small
+INGEST_WORKERS = 2
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+_schema_lock = threading.Lock()
+_schema_ready = False
+# Materials submitted to the pool and not finished yet, so a job is never run twice at once
+_active = set()
+_active_lock = threading.Lock()
+
+
+def init_ingestion_db():
+    """Create the job and chunk tables and resubmit jobs cut short by a restart."""
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        db.ensure_schema(db.MATERIALS_DB, [
+            """
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                sha256 TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                error TEXT,
+                pages INTEGER,
+                chunks INTEGER,
+                tokens INTEGER,
+                queued_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                seconds REAL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs (status)",
+            """
+            CREATE TABLE IF NOT EXISTS material_chunks (
+                sha256 TEXT NOT NULL,
+                chunk_no INTEGER NOT NULL,
+                page INTEGER NOT NULL,
+                citation TEXT NOT NULL,
+                text TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                PRIMARY KEY (sha256, chunk_no)
+            )
+            """,
+        ])
+        _schema_ready = True
+    # Materials uploaded before ingestion existed get queued once
+    materials.init_materials_db()
+    db.execute(
+        db.MATERIALS_DB,
+        """
+        INSERT INTO ingestion_jobs (sha256, status, queued_at)
+        SELECT sha256, ?, ? FROM materials WHERE sha256 IS NOT NULL
+        ON CONFLICT (sha256) DO NOTHING
+        """,
+        (QUEUED, _now()),
+    )
+    unfinished = db.query(db.MATERIALS_DB, "SELECT sha256 FROM ingestion_jobs WHERE status IN (?, ?)", (QUEUED, RUNNING))
+    for (sha256,) in unfinished:
+        _submit(sha256)
+    # Materials ingested before the search index existed are added to it once, from the extraction cache
+    done = db.query(db.MATERIALS_DB, "SELECT sha256 FROM ingestion_jobs WHERE status = ?", (DONE,))
+    _executor.submit(search.reindex, False, [sha256 for (sha256,) in done])
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def enqueue(sha256):
+    """Queue a stored material for ingestion; returns immediately."""
+    init_ingestion_db()
+    db.execute(
+        db.MATERIALS_DB,
+        """
+        INSERT INTO ingestion_jobs (sha256, status, queued_at) VALUES (?, ?, ?)
+        ON CONFLICT (sha256) DO UPDATE SET status = excluded.status, error = NULL, queued_at = excluded.queued_at
+        WHERE ingestion_jobs.status IN (?, ?)
+        """,
+        (sha256, QUEUED, _now(), FAILED, SKIPPED),
+    )
+    _submit(sha256)
+
+
+def _submit(sha256):
+    with _active_lock:
+        if sha256 in _active:
+            return
+        _active.add(sha256)
+    _executor.submit(_run_job, sha256)
+
+
+def _run_job(sha256):
+    try:
+        with tracing.trace("ingestion", kind="job"):
+            _ingest(sha256)
+    finally:
+        with _active_lock:
+            _active.discard(sha256)
+
+
+def _ingest(sha256):
+    claimed = db.execute(
+        db.MATERIALS_DB,
+        "UPDATE ingestion_jobs SET status = ?, started_at = ? WHERE sha256 = ? AND status IN (?, ?)",
+        (RUNNING, _now(), sha256, QUEUED, RUNNING),
+    )
+    if not claimed:
+        return
+    started = time.perf_counter()
+    try:
+        material = materials.get_material(sha256)
+        kind = extraction.kind_for_mime(material["mime_type"]) if material else None
+        if kind is None:
+            db.execute(
+                db.MATERIALS_DB,
+                "UPDATE ingestion_jobs SET status = ?, error = ?, finished_at = ? WHERE sha256 = ?",
+                (SKIPPED, "Text extraction is not supported for this file type.", _now(), sha256),
+            )
+            return
+        pages = extraction.extract_pages(materials.read_material(sha256), kind, sha256)
+        chunks = retrieval.chunk_pages(material["filename"], kind, pages)
+        search.init_search_db()
+        with db.transaction(db.MATERIALS_DB) as conn:
+            conn.execute("DELETE FROM material_chunks WHERE sha256 = ?", (sha256,))
+            conn.executemany(
+                "INSERT INTO material_chunks (sha256, chunk_no, page, citation, text, tokens) VALUES (?, ?, ?, ?, ?, ?)",
+                [(sha256, n, c["page"], c["citation"], c["text"], c["tokens"]) for n, c in enumerate(chunks)],
+            )
+            search.index_material(conn, sha256, material["filename"], pages)
+            conn.execute(
+                """
+                UPDATE ingestion_jobs
+                SET status = ?, pages = ?, chunks = ?, tokens = ?, finished_at = ?, seconds = ?
+                WHERE sha256 = ?
+                """,
+                (DONE, len(pages), len(chunks), sum(c["tokens"] for c in chunks), _now(), time.perf_counter() - started, sha256),
+            )
+    except Exception as e:
+        db.execute(
+            db.MATERIALS_DB,
+            "UPDATE ingestion_jobs SET status = ?, error = ?, finished_at = ? WHERE sha256 = ?",
+            (FAILED, str(e), _now(), sha256),
+        )
+
+
+def job_status(sha256):
+    init_ingestion_db()
+    row = db.query_one(
+        db.MATERIALS_DB,
+        "SELECT status, error, pages, chunks, tokens, seconds FROM ingestion_jobs WHERE sha256 = ?",
+        (sha256,),
+    )
+    return dict(zip(("status", "error", "pages", "chunks", "tokens", "seconds"), row)) if row else None
+
+
+def recent_jobs(limit=20):
+    init_ingestion_db()
+    return db.query(
+        db.MATERIALS_DB,
+        """
+        SELECT m.filename, j.status, j.pages, j.chunks, j.tokens, j.seconds, j.error
+        FROM ingestion_jobs j JOIN materials m ON m.sha256 = j.sha256
+        ORDER BY j.queued_at DESC
+        LIMIT ?
+        """,
+        (limit,),
+    )
+
+
+def ready_materials(limit=200):
+    """Materials whose text is already extracted and chunked, newest first."""
+    init_ingestion_db()
+    rows = db.query(
+        db.MATERIALS_DB,
+        """
+        SELECT m.sha256, m.filename, j.pages, j.tokens
+        FROM materials m JOIN ingestion_jobs j ON j.sha256 = m.sha256
+        WHERE j.status = ?
+        ORDER BY m.upload_time DESC
+        LIMIT ?
+        """,
+        (DONE, limit),
+    )
+    return [dict(zip(("sha256", "filename", "pages", "tokens"), row)) for row in rows]
+
+
+def load_chunks(sha256):
+    rows = db.query(
+        db.MATERIALS_DB,
+        "SELECT page, citation, text, tokens FROM material_chunks WHERE sha256 = ? ORDER BY chunk_no",
+        (sha256,),
+    )
+    return [dict(zip(("page", "citation", "text", "tokens"), row)) for row in rows]
@@ -0,0 +1,272 @@
+import json
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import google.generativeai as genai
+from google.api_core import exceptions as api_exceptions
+
+import tracing
+
+# Most recent calls, newest last, for the latency readouts
+RECENT_CALLS = 200
+MODEL_CACHE_SIZE = 32
+# Requests in flight across the whole app, and for any one student
+MAX_CONCURRENT = 16
+PER_USER_CONCURRENT = 2
+# Sustained request rate and burst size
+REQUESTS_PER_MINUTE = 120
+BURST = 20
+# How long a request may wait for a free slot or rate token before giving up
+QUEUE_TIMEOUT = 60
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 20.0
+
+RETRYABLE_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.DeadlineExceeded,
+)
+
+
+class LLMError(Exception):
+    """Base class for request failures worth showing to the user as a message."""
+
+
+class LLMUnavailableError(LLMError):
+    """Raised when a request can't be served now: the app is at capacity or Gemini keeps failing."""
+
+
+class LLMRequestError(LLMError):
+    """Raised when Gemini rejects the request itself (unknown model, invalid argument); retrying won't help."""
+
+
+class TokenBucket:
+    """Allows ``rate`` requests per second on average with bursts of up to ``capacity``."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, timeout):
+        """Wait for a token; returns False if none is available within timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+_calls = deque(maxlen=RECENT_CALLS)
+_lock = threading.Lock()
+_models = OrderedDict()
+_global_slots = threading.BoundedSemaphore(MAX_CONCURRENT)
+_user_slots = {}
+_bucket = TokenBucket(REQUESTS_PER_MINUTE / 60, BURST)
+
+
+def configure(max_concurrent=None, per_user=None, requests_per_minute=None, burst=None):
+    """Apply deployment limits (e.g. from st.secrets); call before the first request."""
+    global MAX_CONCURRENT, PER_USER_CONCURRENT, _global_slots, _bucket
+    with _lock:
+        if max_concurrent:
+            MAX_CONCURRENT = int(max_concurrent)
+            _global_slots = threading.BoundedSemaphore(MAX_CONCURRENT)
+        if per_user:
+            PER_USER_CONCURRENT = int(per_user)
+            _user_slots.clear()
+        if requests_per_minute or burst:
+            rate = float(requests_per_minute or _bucket.rate * 60) / 60
+            _bucket = TokenBucket(rate, float(burst or _bucket.capacity))
+
+
+def get_model(model_name, generation_config=None):
+    """Shared GenerativeModel for this name and config; building one per rerun is wasted work."""
+    key = (model_name, json.dumps(generation_config or {}, sort_keys=True, default=str))
+    with _lock:
+        if key in _models:
+            _models.move_to_end(key)
+            return _models[key]
+    model_instance = genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+    with _lock:
+        model_instance = _models.setdefault(key, model_instance)
+        while len(_models) > MODEL_CACHE_SIZE:
+            _models.popitem(last=False)
+    return model_instance
+
+
+def _record(metrics):
+    with _lock:
+        _calls.append(metrics)
+    details = {key: metrics[key] for key in ("model", "wait", "retries", "prompt_tokens", "output_tokens") if metrics.get(key) is not None}
+    tracing.record("llm", metrics["page"], metrics.get("total", 0.0), **details)
+
+
+def _user_semaphore(user):
+    with _lock:
+        if user not in _user_slots:
+            _user_slots[user] = threading.BoundedSemaphore(PER_USER_CONCURRENT)
+        return _user_slots[user]
+
+
+@contextmanager
+def _slot(user, metrics, rate_limited=True):
+    """Hold a per-user slot, a global slot and (optionally) a rate token for one request."""
+    started = time.perf_counter()
+    held = []
+    try:
+        for semaphore in ([_user_semaphore(user)] if user is not None else []) + [_global_slots]:
+            remaining = QUEUE_TIMEOUT - (time.perf_counter() - started)
+            if not semaphore.acquire(timeout=max(remaining, 0)):
+                raise LLMUnavailableError("The assistant is busy right now. Please try again in a moment.")
+            held.append(semaphore)
+        if rate_limited and not _bucket.take(QUEUE_TIMEOUT - (time.perf_counter() - started)):
+            raise LLMUnavailableError("Too many requests right now. Please try again in a moment.")
+        metrics["wait"] = metrics.get("wait", 0.0) + time.perf_counter() - started
+        yield
+    finally:
+        for semaphore in reversed(held):
+            semaphore.release()
+
+
+def _backoff(attempt):
+    # Full jitter keeps a class's worth of retries from landing at the same moment
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _rejected(e):
+    if isinstance(e, api_exceptions.NotFound):
+        return LLMRequestError(f"That model isn't available ({getattr(e, 'message', e)}). Please choose another one.")
+    return LLMRequestError(f"Gemini couldn't process this request ({e.__class__.__name__}: {getattr(e, 'message', e)}).")
+
+
+def _call(request, user, metrics, rate_limited=True):
+    """Run request() under the limits, retrying transient errors."""
+    metrics.setdefault("retries", 0)
+    for attempt in range(MAX_RETRIES + 1):
+        with _slot(user, metrics, rate_limited):
+            try:
+                return request()
+            except RETRYABLE_ERRORS as e:
+                if attempt == MAX_RETRIES:
+                    raise LLMUnavailableError(f"Gemini is unavailable right now ({e.__class__.__name__}). Please try again later.") from e
+            except api_exceptions.GoogleAPIError as e:
+                raise _rejected(e) from e
+        metrics["retries"] += 1
+        time.sleep(_backoff(attempt))
+
+
+def _chunk_text(chunk):
+    # Safety-blocked or empty chunks have no text part and raise on .text
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+def _record_usage(metrics, response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        metrics["prompt_tokens"] = usage.prompt_token_count
+        metrics["output_tokens"] = usage.candidates_token_count
+
+
+def stream_generate(model_instance, contents, page, metrics=None, user=None):
+    """Yield the response text piece by piece as Gemini produces it.
+
+    Time to first token and total latency are recorded once the stream is
+    exhausted; pass a dict as ``metrics`` to read them back. The request
+    keeps its concurrency slots until the stream ends.
+    """
+    metrics = metrics if metrics is not None else {}
+    metrics.update({"page": page, "model": model_instance.model_name, "user": user, "stream": True, "ttft": None, "retries": 0})
+    started = time.perf_counter()
+    while True:
+        with _slot(user, metrics):
+            try:
+                response = model_instance.generate_content(contents, stream=True)
+                chars = 0
+                for chunk in response:
+                    text = _chunk_text(chunk)
+                    if not text:
+                        continue
+                    if metrics["ttft"] is None:
+                        metrics["ttft"] = time.perf_counter() - started
+                    chars += len(text)
+                    yield text
+                break
+            except RETRYABLE_ERRORS as e:
+                # Once text has been shown a retry would repeat it, so only failures before the first token are retried
+                if metrics["ttft"] is not None or metrics["retries"] == MAX_RETRIES:
+                    raise LLMUnavailableError(f"Gemini is unavailable right now ({e.__class__.__name__}). Please try again later.") from e
+            except api_exceptions.GoogleAPIError as e:
+                raise _rejected(e) from e
+        time.sleep(_backoff(metrics["retries"]))
+        metrics["retries"] += 1
+    metrics["total"] = time.perf_counter() - started
+    metrics["chars"] = chars
+    _record_usage(metrics, response)
+    _record(metrics)
+
+
+def generate(model_instance, contents, page, metrics=None, user=None):
+    """Blocking call that returns the full response text and records the same metrics."""
+    metrics = metrics if metrics is not None else {}
+    metrics.update({"page": page, "model": model_instance.model_name, "user": user, "stream": False})
+    started = time.perf_counter()
+    response = _call(lambda: model_instance.generate_content(contents), user, metrics)
+    text = _chunk_text(response)
+    metrics["total"] = metrics["ttft"] = time.perf_counter() - started
+    metrics["chars"] = len(text)
+    _record_usage(metrics, response)
+    _record(metrics)
+    return text
+
+
+def count_tokens(model_instance, contents, user=None):
+    metrics = {"page": "count_tokens", "model": model_instance.model_name, "user": user}
+    started = time.perf_counter()
+    result = _call(lambda: model_instance.count_tokens(contents), user, metrics)
+    metrics["total"] = time.perf_counter() - started
+    metrics["prompt_tokens"] = result.total_tokens
+    _record(metrics)
+    return result.total_tokens
+
+
+def upload_file(path, mime_type=None, display_name=None):
+    metrics = {"page": "upload_file"}
+    started = time.perf_counter()
+    remote = _call(lambda: genai.upload_file(path=path, mime_type=mime_type, display_name=display_name), None, metrics)
+    metrics["total"] = time.perf_counter() - started
+    _record(metrics)
+    return remote
+
+
+def get_file(name):
+    # Status polls don't spend the generation rate budget
+    return _call(lambda: genai.get_file(name), None, {}, rate_limited=False)
+
+
+def delete_file(name):
+    return _call(lambda: genai.delete_file(name), None, {}, rate_limited=False)
+
+
+def recent_calls():
+    with _lock:
+        return list(_calls)
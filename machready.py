@@ -2,17 +2,46 @@ import streamlit as st
 import sqlite3
 import google.generativeai as genai
 import pandas as pd
-from PyPDF2 import PdfReader
 import io
-import os
-from pptx import Presentation
-import requests
-import bcrypt
 import pytz
-import uuid
 import base64
-from datetime import datetime, timedelta
+import concurrent.futures
+import functools
+import time
+from datetime import datetime
+import extraction
+import retrieval
+import llm
+import db
+import attendance
+import timezones
+import codes
+import auth
+import materials
+import ingestion
+import response_cache
+import question_bank
+import summarize
+import media
+import tracing
+import roster
+import bitsets
+import exports
+import clock
+import search
 genai.configure(api_key=st.secrets["API_KEY"])
+auth.configure(secret=st.secrets.get("SESSION_SECRET"), rounds=st.secrets.get("BCRYPT_ROUNDS"))
+llm.configure(
+    max_concurrent=st.secrets.get("LLM_MAX_CONCURRENT"),
+    per_user=st.secrets.get("LLM_PER_USER_CONCURRENT"),
+    requests_per_minute=st.secrets.get("LLM_REQUESTS_PER_MINUTE"),
+)
+tracing.configure(
+    enabled=st.secrets.get("REQUEST_LOG", True),
+    path=st.secrets.get("REQUEST_LOG_PATH"),
+    max_bytes=st.secrets.get("REQUEST_LOG_MAX_BYTES"),
+)
+@tracing.traced("page")
 def login_page():
     st.subheader("ThisistheFUTURE")
     st.markdown("<h1 style='text-align: center; color: #ff5733;'>PedoMUS</h1>", unsafe_allow_html=True)
@@ -52,10 +81,33 @@ def login_page():
             st.success(f"Welcome to future of education, {user_id}!")
             st.session_state.login_time = datetime.now(pytz.timezone(get_user_timezone()))
             st.session_state.login_status = True
+            # Signed token in the URL so a refresh or reconnect doesn't redo the bcrypt check
+            st.query_params["session"] = auth.issue_token(user_id, user_type, st.session_state.login_time.timestamp())
             return True
         else:
             st.error("Invalid User ID or Password.")
             
+def restore_session():
+    """Log the user back in from a valid session token after a refresh or reconnect."""
+    claims = auth.verify_token(st.query_params.get("session", ""))
+    if not claims:
+        st.query_params.pop("session", None)
+        return False
+    st.session_state["logged_in"] = True
+    st.session_state["user_id"] = claims["uid"]
+    st.session_state["username"] = claims["uid"]
+    st.session_state["user_role"] = claims["role"]
+    st.session_state.login_time = datetime.fromtimestamp(claims["iat"], pytz.timezone(get_user_timezone()))
+    st.session_state.login_status = True
+    return True
+
+def logout():
+    st.session_state.logged_in = False
+    st.session_state.pop('login_time', None)
+    # Revoked server-side, so the token left in the browser history can't log anyone back in
+    auth.revoke_token(st.query_params.get("session", ""))
+    st.query_params.pop("session", None)
+
 def get_llminfo():
     st.sidebar.header("Options", divider='rainbow')
     model = st.sidebar.radio("Choose LLM:", ("gemini-1.5-pro", "gemini-1.5-flash", "gemini-1.5-standard", "gemini-1.5-advanced"))
@@ -63,53 +115,318 @@ def get_llminfo():
     top_p = st.sidebar.slider("Top P:", 0.0, 1.0, 0.94, 0.01)
     max_tokens = st.sidebar.slider("Maximum Tokens:", 100, 5000, 2000, 100)
     top_k = st.sidebar.slider("Top K:", 0, 100, 50, 1)
+    st.sidebar.toggle("Stream responses", value=True, key="stream_responses")
+    st.sidebar.toggle("Reuse cached answers", value=True, key="use_response_cache")
+    show_response_cache_stats()
     return model, temperature, top_p, max_tokens, top_k
 
-
-def save_teacher_attendance(present_students):
-    """Save the attendance of the selected students to the database."""
+def response_cache_key(model, generation_config, prompt, document_hash=None):
+    """Cache key for this request, or None when the answer shouldn't be reused."""
+    if not st.session_state.get("use_response_cache", True) or not response_cache.is_cacheable(generation_config):
+        response_cache.record_skip()
+        return None
+    return response_cache.make_key(model, generation_config, prompt, document_hash)
+
+def generate_response(model_instance, contents, page, cache_key=None):
+    """Render the model's answer (streamed if enabled) and return the full text."""
+    if cache_key:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            st.markdown(cached)
+            st.caption("Cached answer")
+            return cached
+    metrics = {}
+    user = st.session_state.get("user_id")
     try:
-        date_today = datetime.now().strftime("%Y-%m-%d")
-        conn = sqlite3.connect("attendance.db")
-        cursor = conn.cursor()
-        
-        # Create a table for attendance records if it doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS attendance_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL,
-                student_name TEXT NOT NULL
-            )
-        """)
+        if st.session_state.get("stream_responses", True):
+            text = st.write_stream(llm.stream_generate(model_instance, contents, page, metrics, user))
+        else:
+            text = llm.generate(model_instance, contents, page, metrics, user)
+            st.markdown(text)
+    except llm.LLMError as e:
+        st.error(str(e))
+        return ""
+    if metrics.get("ttft") is not None:
+        st.caption(f"First token after {metrics['ttft']:.2f}s, complete after {metrics['total']:.2f}s")
+    text = text if isinstance(text, str) else "".join(str(part) for part in text)
+    if cache_key:
+        response_cache.put(cache_key, model_instance.model_name, text)
+    return text
+
+def get_retrieval_settings():
+    token_budget = st.sidebar.slider("Context Token Budget:", 500, 30000, 4000, 500)
+    passage_count = st.sidebar.slider("Passages per Question:", 1, 20, 6, 1)
+    st.sidebar.toggle("Read the whole document (map-reduce)", value=False, key="whole_document")
+    return token_budget, passage_count
+
+def answer_from_document(model_instance, model, generation_config, index, question, document_hash, token_budget, passage_count):
+    """Answer from the best-matching passages, or from every chunk when whole-document mode is on."""
+    if st.session_state.get("whole_document"):
+        run_map_reduce(model_instance, model, generation_config, index.chunks, question, document_hash)
+        return
+    # Only the best-matching passages are sent, not every page
+    passages = index.search(question, top_k=passage_count, token_budget=token_budget)
+    prompt = retrieval.build_prompt(question, passages)
+    cache_key = response_cache_key(model, generation_config, prompt, document_hash)
+    generate_response(model_instance, [prompt], "reading_material", cache_key)
+    show_passage_citations(passages)
+
+def run_map_reduce(model_instance, model, generation_config, chunks, question, document_hash):
+    """Summarize (or answer about) every chunk in parallel, then combine; shows the time per stage."""
+    cache_key = response_cache_key(model, generation_config, f"map-reduce: {question or 'summary'}", document_hash)
+    cached = response_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        st.markdown(cached)
+        st.caption("Cached answer")
+        return
+    status = st.empty()
+    try:
+        result = summarize.map_reduce(
+            model_instance, chunks, question,
+            progress=lambda stage: status.caption(f"Running {stage} stage..."),
+            user=st.session_state.get("user_id"),
+        )
+    except llm.LLMError as e:
+        st.error(str(e))
+        return
+    finally:
+        status.empty()
+    st.markdown(result["text"])
+    st.caption(
+        f"{result['groups']} sections; "
+        + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in result["timings"].items())
+    )
+    if cache_key:
+        response_cache.put(cache_key, model_instance.model_name, result["text"])
+
+def upload_digest(uploaded_file):
+    # Hashing a large video on every rerun adds up; hash each upload once per session
+    digests = st.session_state.setdefault("upload_digests", {})
+    if uploaded_file.file_id not in digests:
+        digests[uploaded_file.file_id] = extraction.content_hash(uploaded_file.getvalue())
+    return digests[uploaded_file.file_id]
+
+def gemini_file_for(uploaded_file, label):
+    """Gemini's handle for an uploaded image or video, or None while it is still being processed."""
+    digest = upload_digest(uploaded_file)
+    holder = st.session_state.get("user_id")
+    record = media.get_or_upload(digest, uploaded_file.getvalue(), uploaded_file.name, uploaded_file.type, holder)
+    if record["state"] == media.ACTIVE:
+        return record["file"]
+    if record["state"] == media.FAILED:
+        st.error(f"Failed to process {label}: {record['error']}")
+        if st.button(f"Upload {label} again"):
+            media.forget(digest, holder)
+            st.rerun()
+        return None
+    wait_for_media(digest, label)
+    return None
 
-        # Insert attendance records for present students
-        for student in present_students:
-            cursor.execute("INSERT INTO attendance_records (date, student_name) VALUES (?, ?)", (date_today, student))
-        
-        conn.commit()
-        st.success(f"Attendance recorded for {len(present_students)} students on {date_today}.")
+@st.fragment(run_every=1)
+def wait_for_media(digest, label):
+    # Only this fragment reruns while Gemini processes the file; the page reloads once it's done
+    if media.status(digest) not in (media.UPLOADING, media.PROCESSING):
+        st.rerun()
+    st.info(f"Uploading and processing {label}...")
+
+def show_token_estimate(tokens):
+    # Estimated locally; a remote count_tokens call on every rerun is a network round trip
+    st.caption(f"About {tokens:,} tokens")
+
+def show_passage_citations(passages):
+    with st.expander("Sources"):
+        for passage in passages:
+            st.markdown(f"- {passage['citation']}")
+
+def show_extraction_cache_stats():
+    stats = extraction.cache_stats()
+    st.sidebar.caption(
+        f"Text cache: {stats['hit_rate']:.0%} hit rate "
+        f"({stats['memory_hits'] + stats['disk_hits']} hits / {stats['misses']} misses)"
+    )
+
+def show_response_cache_stats():
+    stats = response_cache.cache_stats()
+    st.sidebar.caption(
+        f"Answer cache: {stats['hit_rate']:.0%} hit rate "
+        f"({stats['memory_hits'] + stats['disk_hits']} hits / {stats['misses']} misses)"
+    )
+
+def show_slowest_operations():
+    """Where recent reruns spent their time, slowest first."""
+    operations = tracing.slowest_operations(limit=25)
+    if not operations:
+        st.info("No operations recorded yet.")
+        return
+    st.write(pd.DataFrame(
+        [(op["kind"], op["name"], op.get("sql") or op.get("model") or "", op["page"], op["user"], op["ms"]) for op in operations],
+        columns=["Kind", "Operation", "Detail", "Page", "User", "ms"],
+    ))
+    traces = tracing.slowest_traces(limit=10)
+    st.write(pd.DataFrame(
+        [(t["page"] or t["name"], t["user"], t["ms"], ", ".join(f"{kind} {ms:.0f}" for kind, ms in t["totals_ms"].items())) for t in traces],
+        columns=["Page", "User", "ms", "Breakdown (ms)"],
+    ))
+
+
+def save_teacher_attendance(present_students=None, course=None, section=None, absent_students=()):
+    """Save the attendance of the selected students, or of a whole course roster minus the absent ones."""
+    try:
+        now = datetime.now()
+        date_today = now.strftime("%Y-%m-%d")
+        time_now = now.strftime("%H:%M:%S")
+        # One statement for the whole class; students already marked today are skipped
+        if present_students is None:
+            added = attendance.record_roster(date_today, course, section, absent_students, time_now)
+            st.success(f"Attendance recorded for {added} students on {date_today}.")
+            return
+        added = attendance.record_attendance(date_today, present_students, course, section, time_now)
+        already_marked = len(set(present_students)) - added
+        st.success(f"Attendance recorded for {added} students on {date_today}.")
+        if already_marked:
+            st.info(f"{already_marked} students were already marked present today.")
     except Exception as e:
         st.error(f"An error occurred while recording attendance: {e}")
-    finally:
-        conn.close()
+
+
+def _pick_student(selection, student_id, widget_key):
+    if st.session_state[widget_key]:
+        selection.add(student_id)
+    else:
+        selection.discard(student_id)
+
+
+def _clear_picks(state_key, selection):
+    selection.clear()
+    for key in [key for key in st.session_state if str(key).startswith(f"{state_key}-pick-")]:
+        del st.session_state[key]
+
+
+def take_attendance(state_key, page_size=25):
+    """Mark students present from a course roster, one searchable page at a time.
+
+    Only the current page of names is sent to the browser; picks are kept in
+    session state as student IDs, so they survive searching and paging.
+    """
+    courses = roster.courses()
+    if not courses:
+        st.info("No course roster has been imported yet. Run `python roster.py enrolments.csv` to add one.")
+        return
+    col1, col2 = st.columns(2)
+    with col1:
+        course = st.selectbox("Course", courses, key=f"{state_key}-course")
+    with col2:
+        section = st.selectbox(
+            "Section",
+            [None] + roster.sections(course),
+            format_func=lambda s: "All sections" if s is None else (s or "No section"),
+            key=f"{state_key}-section",
+        )
+    mark_all = st.radio(
+        "Mark present",
+        [False, True],
+        format_func=lambda everyone: "Everyone except the students I pick" if everyone else "Only the students I pick",
+        horizontal=True,
+        key=f"{state_key}-mode",
+    )
+    prefix = st.text_input("Search by name or student ID", key=f"{state_key}-search")
+
+    # A different course, section or search starts again from the first page
+    cursors_key = f"{state_key}-cursors"
+    if st.session_state.get(f"{state_key}-scope") != (course, section, prefix):
+        st.session_state[f"{state_key}-scope"] = (course, section, prefix)
+        st.session_state[cursors_key] = [None]
+    # Picks are kept per course and section, the scope their attendance is recorded in
+    selection = st.session_state.setdefault(f"{state_key}-picks", {}).setdefault((course, section), set())
+
+    rows = roster.search(course, section, prefix, page_size, after=st.session_state[cursors_key][-1])
+    if not rows:
+        st.info("No students match your search.")
+    for student_id, name, student_section in rows:
+        widget_key = f"{state_key}-pick-{course}-{section}-{student_id}"
+        st.checkbox(
+            f"{name} ({student_id}{', ' + student_section if student_section and section is None else ''})",
+            value=student_id in selection,
+            key=widget_key,
+            on_change=_pick_student,
+            args=(selection, student_id, widget_key),
+        )
+    page_controls(cursors_key, rows, page_size, roster.cursor)
+
+    enrolled = roster.count(course, section)
+    st.caption(f"{len(selection)} picked of {enrolled} enrolled")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.button("Clear picks", key=f"{state_key}-clear", on_click=_clear_picks, args=(state_key, selection), disabled=not selection)
+    with col2:
+        submitted = st.button("Submit Attendance", key=f"{state_key}-submit")
+    if submitted:
+        if mark_all:
+            save_teacher_attendance(course=course, section=section, absent_students=sorted(selection))
+        elif selection:
+            save_teacher_attendance(sorted(selection), course, section)
+        else:
+            st.warning("Please select at least one student.")
 
 def materials_dashboard():
     st.title("Learning Materials")
-    os.makedirs("uploaded_materials", exist_ok=True)
     if st.session_state["user_role"] == "teacher":
         # Teacher can upload files
         uploaded_file = st.file_uploader("Upload Materials", type=['pdf', 'docx', 'pptx'])
         if uploaded_file:
             save_material(uploaded_file)
-    materials = fetch_uploaded_materials()
-    if materials:
+    if materials.count_materials():
         st.subheader("Available Materials")
-        for idx, (filename, upload_time) in enumerate(materials):
-            file_path = os.path.join("uploaded_materials", filename)
-            with open(file_path, "rb") as f:
-                st.download_button(f"Download {filename}", f, file_name=filename, key=f"download-{idx}")
-    else:
+    if not show_material_search("materials_dashboard_search"):
+        show_materials_catalog("materials_dashboard_cursors")
+
+
+def show_materials_catalog(state_key, page_size=20):
+    """Show one page of the catalog; a file is only read from disk when its download is clicked."""
+    st.session_state.setdefault(state_key, [None])
+    page = materials.list_materials(page_size, after=st.session_state[state_key][-1])
+    if not page:
         st.info("No materials have been uploaded yet.")
+        return
+    for material in page:
+        filename = material["filename"]
+        st.markdown(f"**{filename}** uploaded on {material['upload_time']} ({materials.format_size(material['size'])})")
+        st.download_button(
+            f"Download {filename}",
+            data=functools.partial(materials.read_material, material["sha256"]),
+            file_name=filename,
+            mime=material["mime_type"],
+            key=f"{state_key}-download-{material['id']}",
+            on_click="ignore",
+        )
+    page_controls(state_key, page, page_size, lambda material: (material["upload_time"], material["id"]))
+
+
+def show_material_search(key):
+    """A search box over the text of every material; returns True when results replaced the catalog."""
+    query = st.text_input("Search materials", key=key, placeholder="e.g. entropy, Newton's laws")
+    if not query.strip():
+        return False
+    try:
+        results = search.search(query)
+    except Exception as e:
+        st.error(f"Search failed: {e}")
+        return True
+    if not results:
+        st.info("No material mentions that.")
+        return True
+    for n, result in enumerate(results):
+        st.markdown(f"**{result['filename']}**, page {result['page']}")
+        st.caption(" ".join(result["snippet"].split()))
+        st.download_button(
+            f"Download {result['filename']}",
+            data=functools.partial(materials.read_material, result["sha256"]),
+            file_name=result["filename"],
+            mime=result["mime_type"],
+            key=f"{key}-download-{n}",
+            on_click="ignore",
+        )
+    return True
 
 
 def mark_attendance_dashboard():
@@ -119,13 +436,7 @@ def mark_attendance_dashboard():
     st.title(f"{role.capitalize()} Dashboard - Attendance")
     if role == "teacher":
         # Teacher selects students
-        students = [f"Student {i+1}" for i in range(1234)]
-        present_students = st.multiselect("Select students who are present", students)
-        if st.button("Submit Attendance"):
-            if present_students:
-                save_teacher_attendance(present_students)  # Now defined
-            else:
-                st.warning("Please select at least one student.")
+        take_attendance("mark_attendance")
 
 
 def get_user_role(username):
@@ -137,156 +448,127 @@ def get_user_role(username):
             return "student"
     return None
 
-# Initialize database for "present_today"
-def init_present_today_db():
-    conn = sqlite3.connect("attendance.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS present_today (
-            username TEXT PRIMARY KEY,
-            timestamp TEXT NOT NULL
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-# Validate the code
-def validate_code(input_code):
+# Validate the code; returns the (course, section) it was generated for, or None
+def lookup_code(input_code):
     try:
-        conn = sqlite3.connect("codes.db")
-        cursor = conn.cursor()
-
-        # Check the code against the database
-        cursor.execute("SELECT expiration_time FROM codes WHERE code = ?", (input_code,))
-        result = cursor.fetchone()
-
-        if result:
-            expiration_time = datetime.strptime(result[0], "%Y-%m-%d %H:%M:%S")
-            if datetime.now() <= expiration_time:
-                return True  # Code is valid
-
-        return False  # Code is invalid or expired
+        # Live codes are checked in memory; see codes.lookup
+        return codes.lookup(input_code)
     except sqlite3.Error as e:
         st.error(f"Error validating the code: {e}")
-        return False  # Return False in case of database errors
-    finally:
-        conn.close()
+        return None  # Return None in case of database errors
+
+def load_quiz(questions):
+    """Put sampled bank questions into the quiz below, labelled A-D like before."""
+    st.session_state.mcqs = [
+        (q["question"], [f"{letter}) {option}" for letter, option in zip(question_bank.LETTERS, q["options"])])
+        for q in questions
+    ]
+    st.session_state.correct_answers = [q["answer"] for q in questions]
+    st.session_state.explanations = [q["explanation"] for q in questions]
+    st.session_state.user_answers = [None] * len(questions)
 
+@tracing.traced("page")
 def questions_page():
     st.subheader("Questions Page")
-    st.markdown("""The Questions page allows you to upload PDFs and PPTs, automatically extracting the information and generating interactive MCQ questions for practice. To your left is parameter control for the LLM you chose to use.""")
+    st.markdown("""The Questions page lets you practise with MCQs drawn from your course library, or generated from a PDF or PPT you upload. To your left is parameter control for the LLM you chose to use.""")
     model, temperature, top_p, max_tokens, top_k = get_llminfo()
 
-    uploaded_file = st.file_uploader("Upload a PDF or PPT file", type=["pdf", "ppt", "pptx"])
+    source = st.radio("Practise from:", ("Course Library", "Upload a file"), horizontal=True)
+    difficulty = st.radio("Difficulty:", question_bank.DIFFICULTIES, index=1, horizontal=True, format_func=str.capitalize)
 
-    if uploaded_file is not None:
-        text = ""
-        if uploaded_file.type == "application/pdf":
-            pdf_reader = PdfReader(uploaded_file)
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        elif uploaded_file.type in ["application/vnd.ms-powerpoint", "application/vnd.openxmlformats-officedocument.presentationml.presentation"]:
-            presentation = Presentation(uploaded_file)
-            for slide in presentation.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        text += shape.text + "\n"
-            text = text.strip()
-
-        if st.button("Generate MCQs"):
-            if text:
-                generation_config = {
-                    "temperature": temperature,
-                    "top_p": top_p,
-                    "max_output_tokens": max_tokens,
-                    "top_k": top_k
-                }
-                model_instance = genai.GenerativeModel(model_name=model, generation_config=generation_config)
-
-                prompt = (
-                    f"Please generate exactly 5 multiple-choice questions based on the following text:\n\n"
-                    f"{text}\n\n"
-                    "Each question should have 4 options labeled A, B, C, and D. "
-                    "At the end of each question, specify the correct answer in the format:\n"
-                    "Correct Answer: [A/B/C/D]\n\n"
-                    "For example:\n"
-                    "1. What is the capital of France?\n"
-                    "A) Paris\n"
-                    "B) London\n"
-                    "C) Rome\n"
-                    "D) Berlin\n"
-                    "Correct Answer: A\n\n"
-                    "Now generate 5 questions following this format:"
-                )
-                
-                response = model_instance.generate_content([prompt])
-                mcqs_with_answers = response.text.strip().split('\n\n')
-
-                st.session_state.mcqs = []
-                st.session_state.correct_answers = []
-
-                for mcq in mcqs_with_answers:
-                    lines = mcq.split('\n')
-                    if len(lines) < 2:
-                        continue
-                    
-                    question_text = lines[0].strip()
-                    options = [option.strip() for option in lines[1:5] if option.strip()]
-
-                    correct_answer_line = lines[-1] if len(lines) > 5 else ""
-                    correct_answer = correct_answer_line.split(":")[-1].strip().upper()
-                    correct_answer = correct_answer.replace("**", "")
-
-                    if not options or not correct_answer:
-                        continue
-                    
-                    st.session_state.mcqs.append((question_text, options))
-                    st.session_state.correct_answers.append(correct_answer)
-
-                st.session_state.user_answers = [None] * len(st.session_state.mcqs)
-
-        if 'mcqs' in st.session_state:
-            st.subheader("Generated MCQs:")
-            
-            for i, (question_text, options) in enumerate(st.session_state.mcqs):
-                selected_option = st.radio(
-                    question_text, 
-                    options, 
-                    key=f"question_{i}", 
-                    index=options.index(st.session_state.user_answers[i]) if st.session_state.user_answers[i] in options else 0
-                )
-                st.session_state.user_answers[i] = selected_option
+    if source == "Course Library":
+        # Banks are generated in the background when a teacher uploads material, so this is instant
+        banked = [m for m in question_bank.banked_materials() if difficulty in m["difficulties"]]
+        if not banked:
+            st.info(f"No {difficulty} question banks are ready yet.")
+        else:
+            material = st.selectbox("Choose a course material", banked, format_func=lambda m: m["filename"])
+            if st.button("Generate MCQs"):
+                load_quiz(question_bank.sample_questions(material["sha256"], difficulty))
+    else:
+        uploaded_file = st.file_uploader("Upload a PDF or PPT file", type=["pdf", "ppt", "pptx"])
+        if uploaded_file is not None:
+            text = ""
+            kind = extraction.kind_for_mime(uploaded_file.type)
+            if kind:
+                # Cached by content hash, so reruns don't re-parse the upload
+                text = extraction.extract_text(uploaded_file.getvalue(), kind, upload_digest(uploaded_file))
+            show_extraction_cache_stats()
+
+            if st.button("Generate MCQs"):
+                if text:
+                    # The first click fills a bank for this file; later clicks sample from it
+                    digest = upload_digest(uploaded_file)
+                    questions = question_bank.sample_questions(digest, difficulty)
+                    if not questions:
+                        generation_config = {
+                            "temperature": temperature,
+                            "top_p": top_p,
+                            "max_output_tokens": max_tokens,
+                            "top_k": top_k
+                        }
+                        try:
+                            with st.spinner("Generating questions..."):
+                                generated = question_bank.generate_questions(
+                                    text, difficulty, model, generation_config=generation_config, user=st.session_state.get("user_id")
+                                )
+                            if generated:
+                                question_bank.store_questions(digest, difficulty, generated)
+                                questions = question_bank.sample_questions(digest, difficulty)
+                            else:
+                                st.error("The model didn't return any usable questions. Please try again.")
+                        except llm.LLMError as e:
+                            st.error(str(e))
+                    if questions:
+                        load_quiz(questions)
+
+    if 'mcqs' in st.session_state:
+        st.subheader("Generated MCQs:")
+        
+        for i, (question_text, options) in enumerate(st.session_state.mcqs):
+            selected_option = st.radio(
+                question_text, 
+                options, 
+                key=f"question_{i}", 
+                index=options.index(st.session_state.user_answers[i]) if st.session_state.user_answers[i] in options else 0
+            )
+            st.session_state.user_answers[i] = selected_option
 
-            if st.button("Submit Answers"):
-                correct_answers_count = 0
+        if st.button("Submit Answers"):
+            correct_answers_count = 0
 
-                for i, selected_option in enumerate(st.session_state.user_answers):
-                    normalized_selected_option = selected_option[0].upper()
-                    normalized_correct_answer = st.session_state.correct_answers[i].upper()
+            for i, selected_option in enumerate(st.session_state.user_answers):
+                normalized_selected_option = selected_option[0].upper()
+                normalized_correct_answer = st.session_state.correct_answers[i].upper()
 
-                    if normalized_selected_option == normalized_correct_answer:
-                        correct_answers_count += 1
-                
-                total_questions = len(st.session_state.mcqs)
-                st.success(f"You got {correct_answers_count} out of {total_questions} correct!")
+                if normalized_selected_option == normalized_correct_answer:
+                    correct_answers_count += 1
+            
+            total_questions = len(st.session_state.mcqs)
+            st.success(f"You got {correct_answers_count} out of {total_questions} correct!")
+            for i, explanation in enumerate(st.session_state.get("explanations", [])):
+                if explanation:
+                    st.caption(f"Q{i + 1} ({st.session_state.correct_answers[i]}): {explanation}")
 
 
+@tracing.traced("page")
 def reading_material_page():
     st.subheader("Reading Material Interaction")
     st.markdown("""The Reading Material page allows you to upload various types of media, enabling you to chat with a chatbot about the content for better understanding and clarity also providing additional sources to read. To your left is parameter control for the LLM you chose to use.""")
     model, temperature, top_p, max_tokens, top_k = get_llminfo()
+    token_budget, passage_count = get_retrieval_settings()
 
-    typepdf = st.radio("Select the type of media to interact with:", ("PDF", "Images", "Videos", "PPT"), index=0)
+    typepdf = st.radio("Select the type of media to interact with:", ("PDF", "Images", "Videos", "PPT", "Course Library"), index=0)
 
     if typepdf == "PDF":
         st.write("You selected PDF. Upload your files below.")
         uploaded_files = st.file_uploader("Choose one or more PDFs", type='pdf', accept_multiple_files=True)
         if uploaded_files:
             text = ""
-            for pdf in uploaded_files:
-                pdf_reader = PdfReader(pdf)
-                for page in pdf_reader.pages:
-                    text += page.extract_text()
+            digests = [upload_digest(pdf) for pdf in uploaded_files]
+            for pdf, digest in zip(uploaded_files, digests):
+                text += extraction.extract_text(pdf.getvalue(), "pdf", digest)
+            show_extraction_cache_stats()
 
             generation_config = {
                 "temperature": temperature,
@@ -295,32 +577,23 @@ def reading_material_page():
                 "top_k": top_k,
                 "response_mime_type": "text/plain",
             }
-            model_instance = genai.GenerativeModel(
-                model_name=model,
-                generation_config=generation_config,
-            )
-            st.write(model_instance.count_tokens(text))
+            model_instance = llm.get_model(model, generation_config)
+            show_token_estimate(retrieval.estimate_tokens(text))
+            documents = [(pdf.name, "pdf", pdf.getvalue()) for pdf in uploaded_files]
+            index = retrieval.index_for_documents(documents, digests)
+            document_hash = ",".join(digests)
             question = st.text_input("Enter your question and hit return.")
             if question:
-                response = model_instance.generate_content([question, text])
-                st.write(response.text)
+                answer_from_document(model_instance, model, generation_config, index, question, document_hash, token_budget, passage_count)
+            if st.button("Summarize the whole document"):
+                run_map_reduce(model_instance, model, generation_config, index.chunks, None, document_hash)
 
     elif typepdf == "Images":
         st.write("You selected Images. Upload your image file below.")
         image_file = st.file_uploader("Upload your image file.", type=["jpg", "jpeg", "png"])
         if image_file:
-            temp_file_path = image_file.name
-            with open(temp_file_path, "wb") as f:
-                f.write(image_file.getbuffer())
-
-            st.write("Uploading image...")
-            uploaded_image = genai.upload_file(path=temp_file_path)
-            while uploaded_image.state.name == "PROCESSING":
-                time.sleep(5)
-                uploaded_image = genai.get_file(uploaded_image.name)
-
-            if uploaded_image.state.name == "FAILED":
-                st.error("Failed to process image.")
+            uploaded_image = gemini_file_for(image_file, "image")
+            if uploaded_image is None:
                 return
 
             st.write("Image uploaded successfully. Enter your prompt below.")
@@ -332,46 +605,58 @@ def reading_material_page():
                     "max_output_tokens": max_tokens,
                     "top_k": top_k,
                 }
-                response_image = model_instance.generate_content([prompt2, uploaded_image])
-                st.write(response_image.text)
+                model_instance = llm.get_model(model, generation_config)
+                cache_key = response_cache_key(model, generation_config, prompt2, upload_digest(image_file))
+                generate_response(model_instance, [prompt2, uploaded_image], "reading_material", cache_key)
 
     elif typepdf == "Videos":
         st.write("You selected Videos. Upload your video file below.")
         video_file = st.file_uploader("Upload your video file.", type=["mp4", "mov", "avi"])
         if video_file:
-            temp_file_path = video_file.name
-            with open(temp_file_path, "wb") as f:
-                f.write(video_file.getbuffer())
-
-            st.write("Uploading video...")
-            uploaded_video = genai.upload_file(path=temp_file_path)
-            while uploaded_video.state.name == "PROCESSING":
-                time.sleep(5)
-                uploaded_video = genai.get_file(uploaded_video.name)
-
-            if uploaded_video.state.name == "FAILED":
-                st.error("Failed to process video.")
+            # Kept on Gemini while in use, so follow-up prompts about the same video answer straight away
+            uploaded_video = gemini_file_for(video_file, "video")
+            if uploaded_video is None:
                 return
-            
+
             st.write("Video uploaded successfully. Enter your prompt below.")
             prompt3 = st.text_input("Enter your prompt for the video.")
             if prompt3:
-                model_instance = genai.GenerativeModel(model_name=model)
-                response = model_instance.generate_content([uploaded_video, prompt3])
-                st.markdown(response.text)
-                genai.delete_file(uploaded_video.name)
+                model_instance = llm.get_model(model)
+                cache_key = response_cache_key(model, {}, prompt3, upload_digest(video_file))
+                generate_response(model_instance, [uploaded_video, prompt3], "reading_material", cache_key)
+
+    elif typepdf == "Course Library":
+        st.write("You selected Course Library. Ask about material your teacher has uploaded.")
+        # Only materials the ingestion workers have already extracted and chunked
+        ready = ingestion.ready_materials()
+        if not ready:
+            st.info("No course materials are ready yet.")
+            return
+        material = st.selectbox("Choose a course material", ready, format_func=lambda m: f"{m['filename']} ({m['pages']} pages)")
+        # Token counts were recorded at ingestion time
+        show_token_estimate(material["tokens"] or 0)
+        generation_config = {
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_output_tokens": max_tokens,
+            "top_k": top_k,
+            "response_mime_type": "text/plain",
+        }
+        model_instance = llm.get_model(model, generation_config)
+        index = retrieval.index_for_chunks(material["sha256"], functools.partial(ingestion.load_chunks, material["sha256"]))
+        question = st.text_input("Enter your question about this material and hit return.")
+        if question:
+            answer_from_document(model_instance, model, generation_config, index, question, material["sha256"], token_budget, passage_count)
+        if st.button("Summarize the whole document"):
+            run_map_reduce(model_instance, model, generation_config, index.chunks, None, material["sha256"])
 
     elif typepdf == "PPT":
         st.write("You selected PPT. Upload your PowerPoint file below.")
         uploaded_ppt = st.file_uploader("Choose a PPT file", type='pptx')
         if uploaded_ppt:
-            text = ""
-            presentation = Presentation(uploaded_ppt)
-            for slide in presentation.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        text += shape.text + "\n"
-            text = text.strip()
+            document_hash = upload_digest(uploaded_ppt)
+            text = extraction.extract_text(uploaded_ppt.getvalue(), "pptx", document_hash)
+            show_extraction_cache_stats()
             st.write("Extracted text from PowerPoint:")
             st.write(text)
 
@@ -382,16 +667,16 @@ def reading_material_page():
                 "top_k": top_k,
                 "response_mime_type": "text/plain",
             }
-            model_instance = genai.GenerativeModel(
-                model_name=model,
-                generation_config=generation_config,
-            )
-            st.write(model_instance.count_tokens(text))
+            model_instance = llm.get_model(model, generation_config)
+            show_token_estimate(retrieval.estimate_tokens(text))
+            index = retrieval.index_for_documents([(uploaded_ppt.name, "pptx", uploaded_ppt.getvalue())], [document_hash])
             question = st.text_input("Enter your question about the PPT content and hit return.")
             if question:
-                response = model_instance.generate_content([question, text])
-                st.write(response.text)
+                answer_from_document(model_instance, model, generation_config, index, question, document_hash, token_budget, passage_count)
+            if st.button("Summarize the whole document"):
+                run_map_reduce(model_instance, model, generation_config, index.chunks, None, document_hash)
 
+@tracing.traced("page")
 def simulation_page():
     st.subheader("Simulation Page")
     st.write("Select a simulation to view:")
@@ -456,116 +741,29 @@ def simulation_page():
     st.write(f"**{selected_simulation[0]}**")
     st.components.v1.html(selected_simulation[1], height=600)
 
-# Function to get user's timezone based on IP address
+# Function to get user's timezone, preferring the one reported by their browser
 def get_user_timezone():
-    try:
-        response = requests.get("https://ipinfo.io/json")
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("timezone", "UTC")
-    except:
-        pass
-    return "UTC"
-
-# Function to display flip clock based on the user's time zone
-def display_flip_clock():
-    user_timezone = get_user_timezone()
-    now = datetime.now(pytz.timezone(user_timezone))
-
-    flipclock_html = f"""
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/flipclock/0.7.8/flipclock.min.css">
-    <div id="flip-clock" style="display: flex; justify-content: center;"></div>
-    
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/jquery/3.6.0/jquery.min.js"></script>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/flipclock/0.7.8/flipclock.min.js"></script>
-    <script type="text/javascript">
-        document.addEventListener("DOMContentLoaded", function() {{
-            var clock = new FlipClock(document.getElementById('flip-clock'), {{
-                clockFace: 'TwentyFourHourClock',
-                showSeconds: true
-            }});
-        }});
-    </script>
-    """
-    
-    st.components.v1.html(flipclock_html, height=150)
-
-# Function to add JavaScript for detecting tab changes
-def detect_tab_switch():
-    js_code = """
-    <script>
-        document.addEventListener("visibilitychange", function() {
-            if (document.hidden) {
-                alert("You are moving away from this page! Please stay on this tab.");
-            }
-        });
-    </script>
-    """
-    st.components.v1.html(js_code)
-
-def display_session_timer():
-    if "login_time" in st.session_state:
-        # Calculate the elapsed time since login in seconds
-        elapsed_time = (datetime.now(pytz.timezone(get_user_timezone())) - st.session_state.login_time).total_seconds()
-        session_timer_html = f"""
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/flipclock/0.7.8/flipclock.min.css">
-        <div id="session-timer" style="display: flex; justify-content: center;"></div>
-        
-        <script src="https://cdnjs.cloudflare.com/ajax/libs/jquery/3.6.0/jquery.min.js"></script>
-        <script src="https://cdnjs.cloudflare.com/ajax/libs/flipclock/0.7.8/flipclock.min.js"></script>
-        <script type="text/javascript">
-            document.addEventListener("DOMContentLoaded", function() {{
-                var timer = new FlipClock(document.getElementById('session-timer'), {{
-                    clockFace: 'MinuteCounter',
-                    autoStart: true
-                }});
-                // Set the timer to start from the elapsed time
-                timer.setTime({int(elapsed_time)});
-                timer.start();
-            }});
-        </script>
-        """
-        
-        st.components.v1.html(session_timer_html, height=150)
-
-# Initialize database for codes
-def init_code_db():
-    conn = sqlite3.connect("codes.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS codes (
-            code TEXT PRIMARY KEY,
-            expiration_time TEXT NOT NULL
-        )
-    """)
-    conn.commit()
-    conn.close()
+    cached = st.session_state.get("timezone")
+    if cached and cached["expires"] > time.monotonic():
+        return cached["name"]
+
+    name, source = timezones.resolve_timezone(
+        browser_timezone=st.context.timezone,
+        ip=st.context.ip_address,
+        default=st.secrets.get("DEFAULT_TIMEZONE", "UTC"),
+        ip_lookup=st.secrets.get("TIMEZONE_IP_LOOKUP", True),
+    )
+    # A fallback answer is only kept briefly so a later browser/IP answer can replace it
+    ttl = timezones.CACHE_TTL if source != "default" else 30
+    st.session_state["timezone"] = {"name": name, "source": source, "expires": time.monotonic() + ttl}
+    return name
 
 # Generate a unique code
-def generate_unique_code():
-    """Generate a unique attendance code and store it in the database with an expiration time."""
-    code = str(uuid.uuid4())[:8]  # Generate a unique code (8 characters)
-    expiration_time = datetime.now() + timedelta(minutes=6)  # Code expires in 6 minutes
-
+def generate_unique_code(course=None, section=None):
+    """Generate a unique attendance code for a course (and section) and store it with an expiration time."""
     try:
-        conn = sqlite3.connect("codes.db")
-        cursor = conn.cursor()
-
-        # Create the codes table if it doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS codes (
-                code TEXT PRIMARY KEY,
-                expiration_time TEXT NOT NULL
-            )
-        """)
-        conn.commit()
-
-        # Store the code and its expiration time
-        cursor.execute("INSERT INTO codes (code, expiration_time) VALUES (?, ?)", 
-                       (code, expiration_time.strftime("%Y-%m-%d %H:%M:%S")))
-        conn.commit()
-        conn.close()
-        return code, expiration_time
+        # Code expires in 6 minutes; expired codes are purged in the background
+        return codes.generate_code(course, section)
     except Exception as e:
         print(f"Error generating unique code: {e}")
         return None, None
@@ -573,71 +771,73 @@ def generate_unique_code():
 # Authenticate user by checking credentials in the database
 def authenticate(user_id, password):
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT password_hash, user_type FROM users WHERE user_id = ?", (user_id,))
-        user = cursor.fetchone()
-        conn.close()
-
-        if user:
-            hashed_password, user_type = user
-            if bcrypt.checkpw(password.encode('utf-8'), hashed_password):
-                return user_type
+        # bcrypt runs on a bounded worker pool, not the script thread
+        return auth.verify_user(user_id, password)
+    except auth.LoginBusyError as e:
+        st.warning(str(e))
         return None
     except Exception as e:
         st.error(f"Error during authentication: {e}")
         return None
 
 def save_material(uploaded_file):
-    # Ensure directory exists
-    os.makedirs("uploaded_materials", exist_ok=True)
-    conn = sqlite3.connect("shared_materials.db")
-    cursor = conn.cursor()
-    upload_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # The uploader hands back the same file on every rerun; store each upload once
+    saved_uploads = st.session_state.setdefault("saved_uploads", set())
+    if uploaded_file.file_id in saved_uploads:
+        return
     try:
-        # Save file to directory
-        file_path = os.path.join("uploaded_materials", uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-
-        # Save metadata to the database
-        cursor.execute("INSERT INTO materials (filename, upload_time) VALUES (?, ?)", 
-                       (uploaded_file.name, upload_time))
-        conn.commit()
-        st.success(f"File '{uploaded_file.name}' uploaded successfully!")
+        # Stored under its content hash, so identical files are kept only once
+        material, created = materials.save_material(uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)
+        saved_uploads.add(uploaded_file.file_id)
+        # Text extraction and chunking happen on the ingestion workers, not here
+        ingestion.enqueue(material["sha256"])
+        # MCQs for every difficulty are generated at the same time in the background
+        question_bank.enqueue(material["sha256"])
+        if created:
+            st.success(f"File '{uploaded_file.name}' uploaded successfully!")
+        else:
+            st.info(f"File '{uploaded_file.name}' is already in the library as '{material['filename']}'.")
     except Exception as e:
         st.error(f"Failed to upload file: {e}")
-    finally:
-        conn.close()
+
+def show_ingestion_jobs():
+    jobs = ingestion.recent_jobs(10)
+    if not jobs:
+        return
+    with st.expander("Material processing status"):
+        st.write(pd.DataFrame(jobs, columns=["File", "Status", "Pages", "Chunks", "Tokens", "Seconds", "Error"]))
+        bank_jobs = question_bank.recent_jobs(15)
+        if bank_jobs:
+            st.write(pd.DataFrame(bank_jobs, columns=["File", "Difficulty", "Status", "Questions", "Seconds", "Error"]))
+        busy = (ingestion.QUEUED, ingestion.RUNNING)
+        if any(status in busy for _, status, *_ in jobs) or any(status in busy for _, _, status, *_ in bank_jobs):
+            st.button("Refresh status")
 
 # Professor Dashboard (Core App Functionality)
+@tracing.traced("page")
 def professor_dashboard():
     st.title("Professor Dashboard")
 
     # Logout button in the sidebar
     if st.sidebar.button("Logout"):
-        st.session_state.logged_in = False
-        st.session_state.pop('login_time', None)
+        logout()
         st.success("You have been logged out.")
 
     # Attendance section
     st.subheader("Take Attendance")
 
-    # Simulated list of students
-    students = [f"Student {i+1}" for i in range(1234)]
-    present_students = st.multiselect("Select students who are present", students, key="attendance_multiselect")
+    take_attendance("take_attendance")
 
-    if st.button("Submit Attendance"):
-        if present_students:
-            save_teacher_attendance(present_students)  # Ensure this function is defined
-        else:
-            st.warning("Please select at least one student.")
-    
      # Option to generate a unique attendance code
     if st.button("Generate Code"):
-        unique_code, expiration_time = generate_unique_code()
+        # For the class picked under Take Attendance, so students are marked in that session
+        course = st.session_state.get("take_attendance-course")
+        section = st.session_state.get("take_attendance-section")
+        unique_code, expiration_time = generate_unique_code(course, section)
         if unique_code:
             st.success(f"Generated Code: {unique_code}")
+            if course:
+                st.write(f"For {course}{f', section {section}' if section else ''}")
             st.write(f"Code Expires At: {expiration_time.strftime('%H:%M:%S')}")
         else:
             st.error("Failed to generate a code.")
@@ -646,46 +846,29 @@ def professor_dashboard():
     uploaded_file = st.file_uploader("Choose a file to upload", type=['pdf', 'docx', 'pptx'])
     if uploaded_file is not None:
         save_material(uploaded_file)
+    show_ingestion_jobs()
 
     # Option to view attendance records
     st.subheader("View Attendance Records")
     if st.button("Show Attendance Records"):
+        st.session_state.show_attendance_records = True
+    if st.session_state.get("show_attendance_records"):
         try:
-            conn = sqlite3.connect("attendance.db")
-            cursor = conn.cursor()
-
-            # Fetch all attendance records
-            cursor.execute("SELECT date, student_name FROM attendance_records ORDER BY date DESC")
-            attendance_records = cursor.fetchall()
-
-            # Fetch all present today records
-            cursor.execute("SELECT username, timestamp FROM present_today ORDER BY timestamp DESC")
-            present_today_records = cursor.fetchall()
-            conn.close()
-
-            # Convert attendance records to a DataFrame
-            if attendance_records:
-                attendance_df = pd.DataFrame(attendance_records, columns=["Date", "Student Name"])
-                st.write("### Attendance Records")
-                st.write(attendance_df)
-            else:
-                st.info("No attendance records found.")
-
-            # Convert present today records to a DataFrame
-            if present_today_records:
-                present_today_df = pd.DataFrame(present_today_records, columns=["Username", "Timestamp"])
-                st.write("### Present Today Records")
-                st.write(present_today_df)
-            else:
-                st.info("No present today records found.")
-
+            show_attendance_records()
         except Exception as e:
             st.error(f"An error occurred while fetching attendance records: {e}")
 
+    st.subheader("Export Data")
+    show_exports()
+
+    if st.sidebar.toggle("Show slowest operations", key="show_slowest_operations"):
+        st.subheader("Slowest Operations")
+        show_slowest_operations()
+
     # Sidebar statistics (optional)
     st.subheader("Dashboard Statistics")
-    total_students = len(students)
-    attendance_rate = 89  # Placeholder
+    total_students = roster.count()
+    attendance_rate = attendance.attendance_summary(class_size=total_students or None)["rate"]
 
     col1, col2 = st.columns(2)
     with col1:
@@ -693,68 +876,159 @@ def professor_dashboard():
     with col2:
         st.metric(label="Attendance Rate", value=f"{attendance_rate}%")
 
-# Database setup and login system
-def init_db():
-    """Initialize the unified database for all users."""
-    conn = sqlite3.connect('users.db')  # Use a single database for both teachers and students
-    cursor = conn.cursor()
-    
-    # Drop the users table if it exists (to reset schema)
-    cursor.execute("DROP TABLE IF EXISTS users")
-    
-    # Recreate the users table with the correct schema
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            password_hash TEXT NOT NULL,
-            user_type TEXT NOT NULL  -- 'teacher' or 'student'
+def page_controls(state_key, rows, page_size, cursor_for):
+    """Previous/Next buttons for a keyset-paged table; the cursors live in session state."""
+    cursors = st.session_state[state_key]
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Previous page", key=f"{state_key}-previous", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if st.button("Next page", key=f"{state_key}-next", disabled=len(rows) < page_size):
+            cursors.append(cursor_for(rows[-1]))
+            st.rerun()
+
+
+def show_attendance_records(page_size=50):
+    """Paged attendance records plus SQL-side per-day and per-student aggregates."""
+    student_filter = st.text_input("Filter by student", key="records_student").strip()
+    if st.session_state.get("records_filter") != student_filter:
+        st.session_state.records_filter = student_filter
+        st.session_state.records_cursors = [None]
+    st.session_state.setdefault("records_cursors", [None])
+
+    # Newest first, one page at a time
+    records = attendance.fetch_records_page(page_size, after=st.session_state.records_cursors[-1], student=student_filter or None)
+    if records:
+        attendance_df = pd.DataFrame(
+            [(date, time, course, name) for _, date, name, time, course in records],
+            columns=["Date", "Time", "Course", "Student Name"],
         )
-    """)
-    conn.commit()
-    conn.close()
+        st.write("### Attendance Records")
+        st.write(attendance_df)
+        page_controls("records_cursors", records, page_size, lambda row: (row[1], row[0]))
+    else:
+        st.info("No attendance records found.")
+
+    present_today_records = db.query(db.ATTENDANCE_DB, "SELECT username, timestamp FROM present_today ORDER BY timestamp DESC LIMIT ?", (page_size,))
+    if present_today_records:
+        present_today_df = pd.DataFrame(present_today_records, columns=["Username", "Timestamp"])
+        st.write("### Present Today Records")
+        st.write(present_today_df)
+    else:
+        st.info("No present today records found.")
+
+    daily = attendance.daily_counts()
+    if daily:
+        st.write("### Students Present per Day")
+        st.bar_chart(pd.DataFrame(daily, columns=["Day", "Present"]).set_index("Day"))
+
+    st.session_state.setdefault("student_stats_cursors", [None])
+    stats = attendance.student_stats(page_size, after=st.session_state.student_stats_cursors[-1])
+    if stats:
+        st.write("### Per-Student Attendance")
+        st.write(pd.DataFrame(stats, columns=["Student Name", "Days Present", "Rate (%)", "Current Streak", "Longest Streak"]))
+        page_controls("student_stats_cursors", stats, page_size, lambda row: row[0])
+
+    show_term_attendance()
+
+
+def show_term_attendance(recent=5):
+    """Per-course attendance from the session bitsets, with term exports."""
+    courses = roster.courses()
+    if not courses:
+        return
+    st.write("### Term Attendance by Course")
+    course = st.selectbox("Course", courses, key="term_course")
+    days = [day for day, _ in bitsets.sessions(course)]
+    if not days:
+        st.info("No sessions recorded for this course yet.")
+        return
+    last = days[-recent:]
+    missing = bitsets.students(course, bitsets.absent_from_all(course, last))
+    st.caption(f"{len(days)} sessions. {len(missing)} students missed all of the last {len(last)}.")
+    if missing:
+        st.write(pd.DataFrame(missing, columns=["Student ID", "Name"]))
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            "Download term (Parquet)",
+            data=functools.partial(bitsets.export_parquet, course),
+            file_name=f"{course}-attendance.parquet",
+            mime="application/vnd.apache.parquet",
+            key="term_parquet",
+            on_click="ignore",
+        )
+    with col2:
+        st.download_button(
+            "Download term (Arrow)",
+            data=functools.partial(bitsets.export_arrow, course),
+            file_name=f"{course}-attendance.arrow",
+            mime="application/vnd.apache.arrow.file",
+            key="term_arrow",
+            on_click="ignore",
+        )
+
+def show_exports():
+    """Download attendance or the materials catalog; the file is only built when the button is clicked."""
+    col1, col2 = st.columns(2)
+    with col1:
+        dataset = st.selectbox("Data", list(exports.DATASETS), format_func=str.capitalize, key="export_dataset")
+    with col2:
+        fmt = st.radio("Format", exports.FORMATS, format_func=str.upper, horizontal=True, key="export_format")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        start = st.date_input("From", value=None, key="export_start")
+    with col2:
+        end = st.date_input("To", value=None, key="export_end")
+    with col3:
+        student = st.text_input("Student ID", key="export_student", disabled=dataset != "attendance").strip()
+    student = student if dataset == "attendance" else None
+    if start and end and start > end:
+        st.warning("The start date is after the end date.")
+        return
+    st.download_button(
+        f"Download {dataset} ({fmt.upper()})",
+        data=functools.partial(exports.export_bytes, dataset, fmt, start, end, student or None),
+        file_name=exports.file_name(dataset, fmt, start, end, student),
+        mime=exports.MIME_TYPES[fmt],
+        key="export_download",
+        on_click="ignore",
+    )
+
+# Database setup and login system
+def init_db(reset=False):
+    """Initialize the unified database for all users.
+
+    Existing users are kept unless reset=True.
+    """
+    with db.transaction(db.USERS_DB) as conn:  # Use a single database for both teachers and students
+        if reset:
+            # Drop the users table if it exists (to reset schema)
+            conn.execute("DROP TABLE IF EXISTS users")
+
+        # Recreate the users table with the correct schema
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                password_hash TEXT NOT NULL,
+                user_type TEXT NOT NULL  -- 'teacher' or 'student'
+            )
+        """)
     print("Database initialized successfully!")
 
 
 def add_user_to_db(username, password, role):
     try:
-        conn = sqlite3.connect('users.db')
-        c = conn.cursor()
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        c.execute("INSERT INTO users (user_id, password_hash, user_type) VALUES (?, ?, ?)", (username, hashed_password, role))
-        conn.commit()
+        hashed_password = auth.hash_password(password)
+        db.execute(db.USERS_DB, "INSERT INTO users (user_id, password_hash, user_type) VALUES (?, ?, ?)", (username, hashed_password, role))
         print(f"User '{username}' added successfully.")
     except sqlite3.IntegrityError:
         print(f"User '{username}' already exists.")
     except Exception as e:
         print(f"An error occurred: {e}")
-    finally:
-        conn.close()
-
-
-# Shared materials database setup
-def init_materials_db():
-    os.makedirs("uploaded_materials", exist_ok=True)  # Ensure the directory exists
-    conn = sqlite3.connect("shared_materials.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS materials (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT NOT NULL,
-            upload_time TEXT NOT NULL
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-# Fetch uploaded materials
-def fetch_uploaded_materials():
-    init_materials_db()  # Ensure the database is initialized
-    conn = sqlite3.connect("shared_materials.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT filename, upload_time FROM materials ORDER BY upload_time DESC")
-    materials = cursor.fetchall()
-    conn.close()
-    return materials
+
 
 @st.cache_data
 def load_default_timetable():
@@ -787,71 +1061,68 @@ def load_course_info():
     return pd.DataFrame(course_data)
 
 
-def mark_attendance(username):
+def mark_attendance(username, course=None, section=None):
     try:
-        conn = sqlite3.connect("attendance.db")
-        cursor = conn.cursor()
-        
-        # Get the current timestamp
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        # Insert a new attendance record into the attendance_records table
-        cursor.execute("INSERT INTO attendance_records (date, student_name) VALUES (?, ?)", (timestamp, username))
-        
-        conn.commit()
-        st.success(f"Attendance marked successfully for {username} at {timestamp}!")
+        now = datetime.now()
+        date_today = now.strftime("%Y-%m-%d")
+        time_now = now.strftime("%H:%M:%S")
+
+        # Queued with the rest of the class's submissions and committed together; wait for the commit
+        saving = attendance.submit_attendance(date_today, [username], course, section, time_now)
+        try:
+            added = saving.result(timeout=db.BUSY_TIMEOUT_MS / 1000)
+        except concurrent.futures.TimeoutError:
+            # Still queued, not failed: it commits on its own
+            st.info(f"Your attendance for {date_today} is still being saved. There's no need to submit it again.")
+            return
+
+        if added:
+            st.success(f"Attendance marked successfully for {username}{f' in {course}' if course else ''} at {date_today} {time_now}!")
+        else:
+            st.info(f"You're already marked present{f' in {course}' if course else ''} for {date_today}.")
     except Exception as e:
         st.error(f"Failed to mark attendance: {e}")
-    finally:
-        conn.close()
 
 
+@tracing.traced("page")
 def student_dashboard():
     st.sidebar.title("Navigation")
     page = st.sidebar.selectbox("Choose a page", ("Home", "Simulation", "Reading Material", "Questions", "Attendance"))
-    
-    
+
+    # One clock for every page, at a fixed spot in the sidebar so it stays mounted across reruns;
+    # it also warns when the student switches tabs
+    with st.sidebar:
+        clock.session_clock(st.session_state.get("login_time"))
 
     # Logout button in the sidebar
     if st.sidebar.button("Logout"):
-        st.session_state.logged_in = False
-        st.session_state.pop('login_time', None)
+        logout()
         st.success("You have been logged out.")
 
-    # Call the function to detect tab switches
-    detect_tab_switch()
-    
     if page == "Home":
         home()
     elif page == "Simulation":
         st.title("Simulation")
-        display_flip_clock()
-        display_session_timer()
         st.write("Implement simulations")
         simulation_page()
     elif page == "Reading Material":
         st.title("Reading Material")
-        display_flip_clock()
-        display_session_timer()
         st.write("Here are some flashcards/reading material to engage students.")
         reading_material_page()
     elif page == "Questions":
         st.title("Questions")
-        display_flip_clock()
-        display_session_timer()
         st.write("Welcome to the Engaging Page.")
         questions_page()
     elif page == "Attendance":
         st.title("YOUR Attendance")
-        display_flip_clock()
-        display_session_timer()
         st.markdown('''The Attendance page is a time-locked page preventing acess to other websites while in use, and automatically marks your attendance when in class.''')
         Attendance()
 
     
+@tracing.traced("page")
 def Attendance ():   
     st.title("Student Dashboard")
-    init_present_today_db()
+    attendance.init_attendance_db()
    # Ensure the login_time is timezone-aware
     if "login_time" not in st.session_state:
         user_timezone = pytz.timezone(get_user_timezone())
@@ -871,12 +1142,20 @@ def Attendance ():
     # Show the code input field after 3 minutes
     input_code = st.text_input("Enter the code provided by your teacher:")
     if st.button("Submit Code"):
-        if validate_code(input_code):
-            username = st.session_state["user_id"]
-            mark_attendance(username)  # This will now create a new attendance record
+        username = st.session_state["user_id"]
+        wait = codes.allow_attempt(username)
+        if wait:
+            st.warning(f"Too many attempts. Please wait {wait} seconds before trying again.")
         else:
-            st.error("Invalid code. Please try again.")           
+            scope = lookup_code(input_code)
+            if scope is None:
+                st.error("Invalid code. Please try again.")
+            elif scope[0] and not roster.is_enrolled(username, *scope):
+                st.error(f"This code is for {scope[0]}{f', section {scope[1]}' if scope[1] else ''}, and you aren't enrolled there.")
+            else:
+                mark_attendance(username, *scope)
 
+@tracing.traced("page")
 def home():
     st.title("Academic Schedule and Course Information")
     st.write("Welcome to the Home Page.")
@@ -895,16 +1174,8 @@ def home():
 
     with tab3:
         st.subheader("Learning Materials")
-        materials = fetch_uploaded_materials()
-        if materials:
-            for idx, (filename, upload_time) in enumerate(materials):
-                st.markdown(f"**{filename}** uploaded on {upload_time}")
-                file_path = os.path.join("uploaded_materials", filename)
-                with open(file_path, "rb") as f:
-                    # Add a unique key using filename and index
-                    st.download_button(f"Download {filename}", f, file_name=filename, key=f"download-{idx}")
-        else:
-            st.info("No materials have been uploaded yet.")
+        if not show_material_search("home_materials_search"):
+            show_materials_catalog("home_materials_cursors")
 
 def main():
 
@@ -921,10 +1192,13 @@ def main():
 
 
 def app():
-    if "logged_in" not in st.session_state:
-        st.session_state.logged_in = False
+    with tracing.trace("app", user=st.session_state.get("user_id")):
+        if "logged_in" not in st.session_state:
+            st.session_state.logged_in = False
+        if not st.session_state.logged_in and "session" in st.query_params:
+            restore_session()
 
-    main()
+        main()
 
 if __name__ == "__main__":
     app()
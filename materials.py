@@ -0,0 +1,189 @@
+import hashlib
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+
+import db
+
+MATERIALS_DIR = "uploaded_materials"
+# Files are stored once under their SHA-256, whatever name they were uploaded with
+OBJECTS_DIR = os.path.join(MATERIALS_DIR, "objects")
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def object_path(sha256):
+    return os.path.join(OBJECTS_DIR, sha256[:2], sha256)
+
+
+def _write_object(sha256, data):
+    path = object_path(sha256)
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so readers never see a half-written object
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _migrate_legacy_rows(conn):
+    """Point rows from before the content store at a copy of their file in it.
+
+    The old files are left where they are (they may be tracked in the
+    repository); once a row has its hash it is never migrated again.
+    """
+    # Old rows refer to uploaded_materials/<filename>
+    legacy = conn.execute("SELECT id, filename FROM materials WHERE sha256 IS NULL").fetchall()
+    for row_id, filename in legacy:
+        path = os.path.join(MATERIALS_DIR, filename)
+        if os.path.isfile(path):
+            sha256 = _hash_file(path)
+            size = os.path.getsize(path)
+            target = object_path(sha256)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(path, target)
+        else:
+            # A later upload with the same name overwrote this file; it shares that row's content
+            known = conn.execute(
+                "SELECT sha256, size FROM materials WHERE filename = ? AND sha256 IS NOT NULL ORDER BY id LIMIT 1",
+                (filename,),
+            ).fetchone()
+            if not known:
+                continue
+            sha256, size = known
+        conn.execute(
+            "UPDATE materials SET sha256 = ?, size = ?, mime_type = ? WHERE id = ?",
+            (sha256, size, mimetypes.guess_type(filename)[0] or "application/octet-stream", row_id),
+        )
+    # The same content listed twice is the same material; keep its first row
+    conn.execute("""
+        DELETE FROM materials
+        WHERE sha256 IS NOT NULL
+          AND id NOT IN (SELECT MIN(id) FROM materials WHERE sha256 IS NOT NULL GROUP BY sha256)
+    """)
+
+
+def init_materials_db():
+    """Create the materials table, upgrade older schemas and copy legacy files into the store."""
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        os.makedirs(OBJECTS_DIR, exist_ok=True)
+        with db.transaction(db.MATERIALS_DB) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS materials (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT NOT NULL,
+                    upload_time TEXT NOT NULL,
+                    sha256 TEXT,
+                    size INTEGER,
+                    mime_type TEXT
+                )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(materials)")}
+            for column, kind in (("sha256", "TEXT"), ("size", "INTEGER"), ("mime_type", "TEXT")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE materials ADD COLUMN {column} {kind}")
+            _migrate_legacy_rows(conn)
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_materials_sha256 ON materials (sha256)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_materials_upload_time ON materials (upload_time, id)")
+        _schema_ready = True
+
+
+def save_material(filename, data, mime_type=None):
+    """Store an upload by content hash and record it once.
+
+    Returns (material row, created). Uploading bytes that are already in the
+    library returns the existing row instead of adding a duplicate.
+    """
+    init_materials_db()
+    sha256 = hashlib.sha256(data).hexdigest()
+    existing = get_material(sha256)
+    if existing:
+        return existing, False
+    _write_object(sha256, data)
+    mime_type = mime_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    with db.transaction(db.MATERIALS_DB) as conn:
+        conn.execute(
+            """
+            INSERT INTO materials (filename, upload_time, sha256, size, mime_type) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (sha256) DO NOTHING
+            """,
+            (filename, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), sha256, len(data), mime_type),
+        )
+    return get_material(sha256), True
+
+
+def get_material(sha256):
+    row = db.query_one(
+        db.MATERIALS_DB,
+        "SELECT id, filename, upload_time, sha256, size, mime_type FROM materials WHERE sha256 = ?",
+        (sha256,),
+    )
+    return _as_dict(row) if row else None
+
+
+def _as_dict(row):
+    return dict(zip(("id", "filename", "upload_time", "sha256", "size", "mime_type"), row))
+
+
+def list_materials(limit=20, after=None):
+    """One page of the catalog, newest first; pass the previous page's last (upload_time, id) as ``after``."""
+    init_materials_db()
+    where = "WHERE (upload_time, id) < (?, ?)" if after else ""
+    rows = db.query(
+        db.MATERIALS_DB,
+        f"""
+        SELECT id, filename, upload_time, sha256, size, mime_type FROM materials
+        {where}
+        ORDER BY upload_time DESC, id DESC
+        LIMIT ?
+        """,
+        (*(after or ()), limit),
+    )
+    return [_as_dict(row) for row in rows]
+
+
+def count_materials():
+    init_materials_db()
+    return db.query_one(db.MATERIALS_DB, "SELECT COUNT(*) FROM materials")[0]
+
+
+def read_material(sha256):
+    """Return the stored bytes; only called when a download is actually requested."""
+    if not sha256:
+        raise FileNotFoundError("This material's file is missing.")
+    with open(object_path(sha256), "rb") as f:
+        return f.read()
+
+
+def format_size(size):
+    if size is None:
+        return "unknown size"
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
@@ -0,0 +1,167 @@
+import atexit
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import llm
+
+UPLOADING = "UPLOADING"
+PROCESSING = "PROCESSING"
+ACTIVE = "ACTIVE"
+FAILED = "FAILED"
+
+UPLOAD_WORKERS = 4
+# Polling for Gemini's processing starts fast and backs off
+POLL_INITIAL = 0.5
+POLL_MAX = 8.0
+PROCESSING_TIMEOUT = 10 * 60
+# Remote files not used for this long are deleted; Gemini drops them after 48 hours anyway
+IDLE_TTL = 60 * 60
+CLEANUP_INTERVAL = 5 * 60
+DELETE_WORKERS = 8
+
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="media-upload")
+# sha256 -> {"state", "file", "error", "holders"}; holders maps each session using the file to when it last did
+_files = {}
+_lock = threading.Lock()
+_cleaner_started = False
+
+
+def get_or_upload(digest, data, filename, mime_type=None, holder=None):
+    """Return the upload record for these bytes, starting the upload the first time they're seen.
+
+    The call never waits on Gemini: the record's ``state`` is UPLOADING or
+    PROCESSING until the file can be used, then ACTIVE (``file`` is the
+    handle to pass to generate_content) or FAILED (``error`` says why) until
+    ``forget`` is called. The same bytes share one remote file across
+    sessions; ``holder`` names the session so the file outlives any one of them.
+    """
+    _start_cleaner()
+    with _lock:
+        record = _files.get(digest)
+        if record is None:
+            record = {"state": UPLOADING, "file": None, "error": None, "holders": {}}
+            _files[digest] = record
+            _executor.submit(_upload, digest, data, filename, mime_type)
+        record["holders"][holder] = time.time()
+        return {key: value for key, value in record.items() if key != "holders"}
+
+
+def status(digest):
+    with _lock:
+        record = _files.get(digest)
+        return record["state"] if record else None
+
+
+def forget(digest, holder=None):
+    """Release holder's claim on the file; a failed upload is dropped so the next request uploads again.
+
+    A file that still works is only deleted once no other session holds it,
+    so one session can't pull it out from under another.
+    """
+    with _lock:
+        record = _files.get(digest)
+        if record is None:
+            return
+        record["holders"].pop(holder, None)
+        if record["state"] != FAILED and record["holders"]:
+            return
+        del _files[digest]
+    _delete_remote([record])
+
+
+def _set(digest, **fields):
+    with _lock:
+        if digest in _files:
+            _files[digest].update(fields)
+
+
+def _upload(digest, data, filename, mime_type):
+    # A private temp file; the upload's original name could clash with another user's or with app files
+    suffix = os.path.splitext(filename)[1]
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        remote = llm.upload_file(path=path, mime_type=mime_type, display_name=filename)
+    except Exception as e:
+        _set(digest, state=FAILED, error=str(e))
+        return
+    finally:
+        os.remove(path)
+    _set(digest, state=PROCESSING, file=remote)
+    _wait_until_active(digest, remote)
+
+
+def _wait_until_active(digest, remote):
+    delay = POLL_INITIAL
+    deadline = time.monotonic() + PROCESSING_TIMEOUT
+    try:
+        while remote.state.name == PROCESSING:
+            if time.monotonic() > deadline:
+                _set(digest, state=FAILED, error="Gemini took too long to process the file.")
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_MAX)
+            remote = llm.get_file(remote.name)
+    except Exception as e:
+        _set(digest, state=FAILED, error=str(e))
+        return
+    if remote.state.name == ACTIVE:
+        _set(digest, state=ACTIVE, file=remote)
+    else:
+        _set(digest, state=FAILED, file=remote, error=f"Gemini could not process the file ({remote.state.name}).")
+
+
+def _delete_remote(records):
+    # One pass over many files, a few requests at a time
+    names = [record["file"].name for record in records if record["file"] is not None]
+    if not names:
+        return
+    with ThreadPoolExecutor(max_workers=min(DELETE_WORKERS, len(names))) as pool:
+        list(pool.map(_delete_one, names))
+
+
+def _delete_one(name):
+    try:
+        llm.delete_file(name)
+    except Exception:
+        # Already gone, or it expires on its own within 48 hours
+        pass
+
+
+def delete_idle(max_idle=IDLE_TTL):
+    """Forget and delete remote files no session has used for max_idle seconds; returns how many."""
+    cutoff = time.time() - max_idle
+    with _lock:
+        for record in _files.values():
+            record["holders"] = {holder: used for holder, used in record["holders"].items() if used >= cutoff}
+        idle = [
+            digest for digest, record in _files.items()
+            if not record["holders"] and record["state"] in (ACTIVE, FAILED)
+        ]
+        records = [_files.pop(digest) for digest in idle]
+    _delete_remote(records)
+    return len(records)
+
+
+def _cleanup_loop():
+    while True:
+        time.sleep(CLEANUP_INTERVAL)
+        delete_idle()
+
+
+def _start_cleaner():
+    global _cleaner_started
+    with _lock:
+        if _cleaner_started:
+            return
+        _cleaner_started = True
+    threading.Thread(target=_cleanup_loop, name="media-cleanup", daemon=True).start()
+
+
+@atexit.register
+def _delete_all():
+    delete_idle(max_idle=-1)
@@ -0,0 +1,188 @@
+"""Bulk user provisioning.
+
+    python provision.py cohort.csv --batch-size 500 --errors rejected.csv
+
+Input is CSV (header: user_id,password[,role]) or JSON Lines with the same
+keys. Passwords are hashed on a process pool and users are inserted in one
+transaction per batch. Bad rows are reported and skipped; they never abort
+the import.
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import auth
+import db
+
+ROLES = ("teacher", "student")
+# bcrypt only reads the first 72 bytes of a password, and bcrypt 5 rejects longer ones
+MAX_PASSWORD_BYTES = 72
+
+
+def read_rows(path):
+    """Yield (line number, row dict) from a CSV or JSONL file."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, {"_error": f"invalid JSON: {e}"}
+        else:
+            for number, row in enumerate(csv.DictReader(f), start=2):
+                yield number, row
+
+
+def default_role(user_id):
+    # Same rule as the login page: five digits for teachers, fewer for students
+    return "teacher" if len(user_id) == 5 else "student"
+
+
+def validate_row(row):
+    """Return (user_id, password, role) or raise ValueError with the reason."""
+    if "_error" in row:
+        raise ValueError(row["_error"])
+    user_id = str(row.get("user_id") or "").strip()
+    password = str(row.get("password") or "")
+    role = str(row.get("role") or "").strip().lower() or default_role(user_id)
+    if not user_id.isdigit():
+        raise ValueError("user_id must be numerical")
+    if not password:
+        raise ValueError("password is empty")
+    if len(password.encode("utf-8")) > MAX_PASSWORD_BYTES:
+        raise ValueError(f"password is longer than {MAX_PASSWORD_BYTES} bytes")
+    if role not in ROLES:
+        raise ValueError(f"role must be one of {', '.join(ROLES)}")
+    return user_id, password, role
+
+
+def _hash(args):
+    """(hash, None), or (None, reason) if this password can't be hashed."""
+    password, rounds = args
+    try:
+        return auth.hash_password(password, rounds), None
+    except (ValueError, TypeError) as e:
+        return None, f"password could not be hashed: {e}"
+
+
+def _existing_ids(user_ids):
+    rows = db.query(
+        db.USERS_DB,
+        "SELECT user_id FROM users WHERE user_id IN (SELECT value FROM json_each(?))",
+        (json.dumps(user_ids),),
+    )
+    return {row[0] for row in rows}
+
+
+def _import_batch(batch, pool, rounds, errors):
+    existing = _existing_ids([user_id for _, (user_id, _, _) in batch])
+    fresh = []
+    for number, (user_id, password, role) in batch:
+        if user_id in existing:
+            errors.append((number, user_id, "user already exists"))
+        else:
+            fresh.append((number, user_id, password, role))
+    hashes = pool.map(_hash, [(password, rounds) for _, _, password, _ in fresh], chunksize=8)
+    users = []
+    for (number, user_id, _, role), (hashed, error) in zip(fresh, hashes):
+        if error:
+            errors.append((number, user_id, error))
+        else:
+            users.append((number, user_id, hashed, role))
+    insert = "INSERT INTO users (user_id, password_hash, user_type) VALUES (?, ?, ?)"
+    try:
+        with db.transaction(db.USERS_DB) as conn:
+            conn.executemany(insert, [(user_id, hashed, role) for _, user_id, hashed, role in users])
+        return len(users)
+    except sqlite3.IntegrityError:
+        pass
+    # Someone created one of these users since the existence check; insert the rest one at a time
+    imported = 0
+    with db.transaction(db.USERS_DB) as conn:
+        for number, user_id, hashed, role in users:
+            try:
+                conn.execute(insert, (user_id, hashed, role))
+                imported += 1
+            except sqlite3.IntegrityError:
+                errors.append((number, user_id, "user already exists"))
+    return imported
+
+
+def import_users(rows, batch_size=500, workers=None, rounds=None, progress=None):
+    """Provision users from (line number, row dict) pairs.
+
+    Returns (imported count, errors) where errors is a list of
+    (line number, user_id, reason). ``progress`` is called with
+    (rows processed, imported, errors) after every batch.
+    """
+    db.ensure_schema(db.USERS_DB, ["""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            password_hash TEXT NOT NULL,
+            user_type TEXT NOT NULL  -- 'teacher' or 'student'
+        )
+    """])
+    rounds = rounds or auth.DEFAULT_ROUNDS
+    imported = 0
+    processed = 0
+    errors = []
+    seen = set()
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for number, row in rows:
+            processed += 1
+            try:
+                user = validate_row(row)
+            except ValueError as e:
+                errors.append((number, str(row.get("user_id", "")), str(e)))
+                continue
+            if user[0] in seen:
+                errors.append((number, user[0], "duplicate user_id in input"))
+                continue
+            seen.add(user[0])
+            batch.append((number, user))
+            if len(batch) >= batch_size:
+                imported += _import_batch(batch, pool, rounds, errors)
+                batch = []
+                if progress:
+                    progress(processed, imported, len(errors))
+        if batch:
+            imported += _import_batch(batch, pool, rounds, errors)
+        if progress:
+            progress(processed, imported, len(errors))
+    return imported, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-import users from CSV or JSON Lines.")
+    parser.add_argument("path", help="CSV (user_id,password[,role]) or .jsonl file")
+    parser.add_argument("--batch-size", type=int, default=500, help="users per transaction")
+    parser.add_argument("--workers", type=int, default=None, help="hashing processes (default: CPU count)")
+    parser.add_argument("--rounds", type=int, default=auth.DEFAULT_ROUNDS, help="bcrypt cost factor")
+    parser.add_argument("--errors", help="write rejected rows to this CSV file")
+    args = parser.parse_args()
+
+    def report(processed, imported, error_count):
+        print(f"processed {processed} rows: {imported} imported, {error_count} rejected", file=sys.stderr)
+
+    imported, errors = import_users(read_rows(args.path), args.batch_size, args.workers, args.rounds, report)
+    for number, user_id, reason in errors:
+        print(f"line {number}: {user_id or '?'}: {reason}", file=sys.stderr)
+    if args.errors:
+        with open(args.errors, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["line", "user_id", "reason"])
+            writer.writerows(errors)
+    print(f"Imported {imported} users, rejected {len(errors)}.")
+    db.close_all()
+    return 0 if not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import db
+import extraction
+import llm
+import materials
+import tracing
+
+# Model used for banks generated in the background, where nobody has picked one
+DEFAULT_MODEL = "gemini-1.5-flash"
+DIFFICULTIES = ("easy", "medium", "hard")
+QUESTIONS_PER_LEVEL = 15
+# Source text sent with each generation request
+SOURCE_TOKEN_BUDGET = 30000
+# One worker per difficulty so every level of a material is generated at the same time
+BANK_WORKERS = len(DIFFICULTIES)
+LETTERS = "ABCD"
+# Output room per question; JSON cut off by the token limit can't be parsed at all
+TOKENS_PER_QUESTION = 200
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+# Gemini fills this structure directly, so nothing has to be parsed out of free text
+MCQ_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string"},
+            "options": {"type": "array", "items": {"type": "string"}},
+            "answer": {"type": "string", "enum": list(LETTERS)},
+            "explanation": {"type": "string"},
+        },
+        "required": ["question", "options", "answer"],
+    },
+}
+
+_DIFFICULTY_HINTS = {
+    "easy": "recall of definitions and facts stated directly in the text",
+    "medium": "understanding and applying the concepts in the text",
+    "hard": "analysis, multi-step reasoning or comparing ideas from different parts of the text",
+}
+
+_executor = ThreadPoolExecutor(max_workers=BANK_WORKERS, thread_name_prefix="question-bank")
+_schema_lock = threading.Lock()
+_schema_ready = False
+# (sha256, difficulty) pairs submitted and not finished yet
+_active = set()
+_active_lock = threading.Lock()
+
+
+def init_question_bank_db():
+    """Create the bank and job tables and resubmit jobs cut short by a restart."""
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        db.ensure_schema(db.MATERIALS_DB, [
+            """
+            CREATE TABLE IF NOT EXISTS question_bank (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sha256 TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                question TEXT NOT NULL,
+                options TEXT NOT NULL,  -- JSON list of four options
+                answer TEXT NOT NULL,   -- 'A' to 'D'
+                explanation TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_question_bank_material ON question_bank (sha256, difficulty)",
+            """
+            CREATE TABLE IF NOT EXISTS question_bank_jobs (
+                sha256 TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                model TEXT NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                questions INTEGER,
+                queued_at TEXT NOT NULL,
+                finished_at TEXT,
+                seconds REAL,
+                PRIMARY KEY (sha256, difficulty)
+            )
+            """,
+        ])
+        _schema_ready = True
+    materials.init_materials_db()
+    unfinished = db.query(
+        db.MATERIALS_DB,
+        "SELECT sha256, difficulty, model FROM question_bank_jobs WHERE status IN (?, ?)",
+        (QUEUED, RUNNING),
+    )
+    for sha256, difficulty, model in unfinished:
+        _submit(sha256, difficulty, model)
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def enqueue(sha256, difficulties=DIFFICULTIES, model=DEFAULT_MODEL):
+    """Queue bank generation for a stored material, one job per difficulty; returns immediately."""
+    init_question_bank_db()
+    with db.transaction(db.MATERIALS_DB) as conn:
+        conn.executemany(
+            """
+            INSERT INTO question_bank_jobs (sha256, difficulty, model, status, queued_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (sha256, difficulty) DO UPDATE
+            SET model = excluded.model, status = excluded.status, error = NULL, queued_at = excluded.queued_at
+            WHERE question_bank_jobs.status IN (?, ?)
+            """,
+            [(sha256, difficulty, model, QUEUED, _now(), FAILED, SKIPPED) for difficulty in difficulties],
+        )
+    for difficulty in difficulties:
+        _submit(sha256, difficulty, model)
+
+
+def _submit(sha256, difficulty, model):
+    with _active_lock:
+        if (sha256, difficulty) in _active:
+            return
+        _active.add((sha256, difficulty))
+    _executor.submit(_run_job, sha256, difficulty, model)
+
+
+def _run_job(sha256, difficulty, model):
+    try:
+        with tracing.trace("question_bank", kind="job"):
+            _build_bank(sha256, difficulty, model)
+    finally:
+        with _active_lock:
+            _active.discard((sha256, difficulty))
+
+
+def _finish(sha256, difficulty, status, error=None, questions=None, seconds=None):
+    db.execute(
+        db.MATERIALS_DB,
+        """
+        UPDATE question_bank_jobs SET status = ?, error = ?, questions = ?, finished_at = ?, seconds = ?
+        WHERE sha256 = ? AND difficulty = ?
+        """,
+        (status, error, questions, _now(), seconds, sha256, difficulty),
+    )
+
+
+def _build_bank(sha256, difficulty, model):
+    claimed = db.execute(
+        db.MATERIALS_DB,
+        "UPDATE question_bank_jobs SET status = ? WHERE sha256 = ? AND difficulty = ? AND status IN (?, ?)",
+        (RUNNING, sha256, difficulty, QUEUED, RUNNING),
+    )
+    if not claimed:
+        return
+    started = time.perf_counter()
+    try:
+        material = materials.get_material(sha256)
+        kind = extraction.kind_for_mime(material["mime_type"]) if material else None
+        if kind is None:
+            _finish(sha256, difficulty, SKIPPED, "Text extraction is not supported for this file type.")
+            return
+        pages = extraction.extract_pages(materials.read_material(sha256), kind, sha256)
+        questions = generate_questions("\n".join(pages), difficulty, model)
+        if not questions:
+            _finish(sha256, difficulty, FAILED, "The model returned no usable questions.")
+            return
+        store_questions(sha256, difficulty, questions)
+        _finish(sha256, difficulty, DONE, questions=len(questions), seconds=time.perf_counter() - started)
+    except Exception as e:
+        _finish(sha256, difficulty, FAILED, str(e))
+
+
+def _source_text(text):
+    # Keep the request inside the budget (about four characters per token, as in retrieval.estimate_tokens)
+    return text[:SOURCE_TOKEN_BUDGET * 4]
+
+
+def generate_questions(text, difficulty, model=DEFAULT_MODEL, count=QUESTIONS_PER_LEVEL, generation_config=None, user=None):
+    """Ask Gemini for ``count`` questions as schema-checked JSON and return the valid ones.
+
+    Pass the requesting ``user`` for generation a student started, so it counts against their limit.
+    """
+    config = dict(generation_config or {})
+    config.update({"response_mime_type": "application/json", "response_schema": MCQ_SCHEMA})
+    config["max_output_tokens"] = max(config.get("max_output_tokens", 0), count * TOKENS_PER_QUESTION)
+    model_instance = llm.get_model(model, config)
+    prompt = (
+        f"Write {count} {difficulty} multiple-choice questions testing "
+        f"{_DIFFICULTY_HINTS.get(difficulty, 'the content of the text')}.\n"
+        "Each question has exactly four options, given without letter prefixes. "
+        "`answer` is the letter (A, B, C or D) of the correct option and "
+        "`explanation` says in one sentence why it is correct.\n\n"
+        f"Text:\n{_source_text(text)}"
+    )
+    return parse_questions(llm.generate(model_instance, [prompt], "question_bank", user=user))
+
+
+def parse_questions(raw):
+    """Validate the model's JSON; malformed items are dropped instead of breaking the quiz."""
+    try:
+        items = json.loads(raw)
+    except ValueError:
+        return []
+    questions = []
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        question = str(item.get("question") or "").strip()
+        options = [str(option).strip() for option in item.get("options") or []]
+        answer = str(item.get("answer") or "").strip().upper()
+        if not question or len(options) != len(LETTERS) or not all(options) or answer not in LETTERS:
+            continue
+        questions.append({
+            "question": question,
+            "options": options,
+            "answer": answer,
+            "explanation": str(item.get("explanation") or "").strip(),
+        })
+    return questions
+
+
+def store_questions(sha256, difficulty, questions):
+    """Replace the bank for one material and difficulty."""
+    init_question_bank_db()
+    with db.transaction(db.MATERIALS_DB) as conn:
+        conn.execute("DELETE FROM question_bank WHERE sha256 = ? AND difficulty = ?", (sha256, difficulty))
+        conn.executemany(
+            "INSERT INTO question_bank (sha256, difficulty, question, options, answer, explanation) VALUES (?, ?, ?, ?, ?, ?)",
+            [(sha256, difficulty, q["question"], json.dumps(q["options"]), q["answer"], q["explanation"]) for q in questions],
+        )
+
+
+def sample_questions(sha256, difficulty, count=5):
+    """Random questions from the bank; an empty list means it hasn't been generated yet."""
+    init_question_bank_db()
+    rows = db.query(
+        db.MATERIALS_DB,
+        """
+        SELECT question, options, answer, explanation FROM question_bank
+        WHERE sha256 = ? AND difficulty = ?
+        ORDER BY random()
+        LIMIT ?
+        """,
+        (sha256, difficulty, count),
+    )
+    return [
+        {"question": question, "options": json.loads(options), "answer": answer, "explanation": explanation}
+        for question, options, answer, explanation in rows
+    ]
+
+
+def banked_materials(limit=200):
+    """Materials with at least one finished bank, newest first, with the levels available."""
+    init_question_bank_db()
+    rows = db.query(
+        db.MATERIALS_DB,
+        """
+        SELECT m.sha256, m.filename, group_concat(j.difficulty)
+        FROM materials m JOIN question_bank_jobs j ON j.sha256 = m.sha256
+        WHERE j.status = ?
+        GROUP BY m.sha256
+        ORDER BY m.upload_time DESC
+        LIMIT ?
+        """,
+        (DONE, limit),
+    )
+    return [
+        {"sha256": sha256, "filename": filename, "difficulties": [d for d in DIFFICULTIES if d in levels.split(",")]}
+        for sha256, filename, levels in rows
+    ]
+
+
+def recent_jobs(limit=20):
+    init_question_bank_db()
+    return db.query(
+        db.MATERIALS_DB,
+        """
+        SELECT m.filename, j.difficulty, j.status, j.questions, j.seconds, j.error
+        FROM question_bank_jobs j JOIN materials m ON m.sha256 = j.sha256
+        ORDER BY j.queued_at DESC, m.filename, j.difficulty
+        LIMIT ?
+        """,
+        (limit,),
+    )
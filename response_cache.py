@@ -0,0 +1,133 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import db
+
+CACHE_DB = "llm_cache.db"
+MEMORY_CACHE_SIZE = 256
+# Answers older than this are regenerated
+TTL_SECONDS = 7 * 24 * 60 * 60
+# Rows kept on disk; the oldest are evicted first
+MAX_ROWS = 20000
+# Sampling above this temperature is meant to vary, so those answers are never cached
+MAX_CACHE_TEMPERATURE = 1.0
+
+_memory_cache = OrderedDict()
+_lock = threading.Lock()
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "skipped": 0}
+_puts_since_trim = 0
+
+
+def init_cache_db():
+    db.ensure_schema(CACHE_DB, [
+        """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_responses_created_at ON responses (created_at)",
+    ])
+
+
+def normalize_prompt(prompt):
+    """Case and whitespace differences between students' questions shouldn't miss the cache."""
+    return " ".join(prompt.lower().split()).rstrip(" ?.!")
+
+
+def is_cacheable(generation_config):
+    return (generation_config or {}).get("temperature", 1.0) <= MAX_CACHE_TEMPERATURE
+
+
+def make_key(model, generation_config, prompt, document_hash=None):
+    """Key on everything that changes the answer: model, sampling settings, prompt and source document."""
+    payload = json.dumps(
+        [model, generation_config or {}, normalize_prompt(prompt), document_hash or ""],
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _remember(key, value):
+    # Caller must hold _lock
+    _memory_cache[key] = value
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache) > MEMORY_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+
+def get(key):
+    """Return the cached response text, or None on a miss or expired entry."""
+    now = time.time()
+    with _lock:
+        entry = _memory_cache.get(key)
+        if entry and entry[1] + TTL_SECONDS > now:
+            _memory_cache.move_to_end(key)
+            _stats["memory_hits"] += 1
+            return entry[0]
+    row = db.query_one(CACHE_DB, "SELECT response, created_at FROM responses WHERE key = ? AND created_at > ?", (key, int(now - TTL_SECONDS)))
+    with _lock:
+        if row:
+            _stats["disk_hits"] += 1
+            _remember(key, (row[0], row[1]))
+            return row[0]
+        _stats["misses"] += 1
+    return None
+
+
+def put(key, model, response):
+    global _puts_since_trim
+    if not response:
+        return
+    now = int(time.time())
+    db.execute(
+        CACHE_DB,
+        "INSERT OR REPLACE INTO responses (key, model, response, created_at) VALUES (?, ?, ?, ?)",
+        (key, model, response, now),
+    )
+    with _lock:
+        _stats["stores"] += 1
+        _remember(key, (response, now))
+        _puts_since_trim += 1
+        trim = _puts_since_trim >= 100
+        if trim:
+            _puts_since_trim = 0
+    if trim:
+        evict()
+
+
+def record_skip():
+    with _lock:
+        _stats["skipped"] += 1
+
+
+def evict():
+    """Drop expired rows and keep the table under MAX_ROWS."""
+    with db.transaction(CACHE_DB) as conn:
+        conn.execute("DELETE FROM responses WHERE created_at <= ?", (int(time.time() - TTL_SECONDS),))
+        conn.execute(
+            """
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (MAX_ROWS,),
+        )
+
+
+def cache_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["memory_entries"] = len(_memory_cache)
+    lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+    return stats
+
+
+init_cache_db()
@@ -0,0 +1,151 @@
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import extraction
+
+# Pages longer than this are split into overlapping windows of words
+CHUNK_WORDS = 350
+CHUNK_OVERLAP = 50
+# Number of document sets whose index is kept in memory
+INDEX_CACHE_SIZE = 16
+
+_TOKEN_RE = re.compile(r"\w+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "which",
+    "who", "why", "with",
+}
+
+_index_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate (roughly four characters per token)."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def chunk_pages(source, kind, pages):
+    """Split a document's pages (or slides) into chunks that remember where they came from."""
+    unit = "slide" if kind == "pptx" else "p."
+    chunks = []
+    for number, page_text in enumerate(pages, start=1):
+        words = page_text.split()
+        if not words:
+            continue
+        step = CHUNK_WORDS - CHUNK_OVERLAP
+        for start in range(0, max(len(words) - CHUNK_OVERLAP, 1), step):
+            text = " ".join(words[start:start + CHUNK_WORDS])
+            chunks.append({
+                "source": source,
+                "citation": f"{source}, {unit} {number}",
+                "page": number,
+                "text": text,
+                "tokens": estimate_tokens(text),
+            })
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 ranking over a fixed list of chunks."""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.lengths = []
+        self.postings = {}
+        for position, chunk in enumerate(chunks):
+            terms = Counter(tokenize(chunk["text"]))
+            self.lengths.append(sum(terms.values()))
+            for term, freq in terms.items():
+                self.postings.setdefault(term, []).append((position, freq))
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def _idf(self, term):
+        n = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.chunks) - n + 0.5) / (n + 0.5))
+
+    def rank(self, query):
+        """Return (score, position) pairs for chunks matching the query, best first."""
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self._idf(term)
+            for position, freq in self.postings.get(term, ()):
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / (self.avg_length or 1))
+                scores[position] = scores.get(position, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+        return sorted(((score, pos) for pos, score in scores.items()), key=lambda item: (-item[0], item[1]))
+
+    def search(self, query, top_k=6, token_budget=4000):
+        """Return at most top_k chunks for the query whose combined size fits the token budget."""
+        ranked = [pos for _, pos in self.rank(query)]
+        if not ranked:
+            # Nothing matched; fall back to the start of the material
+            ranked = range(len(self.chunks))
+        selected = []
+        used = 0
+        for pos in ranked:
+            chunk = self.chunks[pos]
+            if used + chunk["tokens"] > token_budget:
+                continue
+            selected.append(chunk)
+            used += chunk["tokens"]
+            if len(selected) >= top_k:
+                break
+        return selected
+
+
+def _cached_index(key, load_chunks):
+    with _lock:
+        if key in _index_cache:
+            _index_cache.move_to_end(key)
+            return _index_cache[key]
+
+    index = BM25Index(load_chunks())
+
+    with _lock:
+        _index_cache[key] = index
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def index_for_documents(documents, digests=None):
+    """Build (or reuse) the index for a set of (name, kind, bytes) documents.
+
+    Pass ``digests`` when the caller has already hashed the documents.
+    """
+    if digests is None:
+        digests = [extraction.content_hash(data) for _, _, data in documents]
+
+    def load_chunks():
+        chunks = []
+        for (name, kind, data), digest in zip(documents, digests):
+            chunks.extend(chunk_pages(name, kind, extraction.extract_pages(data, kind, digest)))
+        return chunks
+
+    return _cached_index(tuple(digests), load_chunks)
+
+
+def index_for_chunks(sha256, load_chunks):
+    """Build (or reuse) the index for a material whose chunks were stored at ingestion time."""
+    return _cached_index(("stored", sha256), load_chunks)
+
+
+def format_passages(chunks):
+    return "\n\n".join(f"[{chunk['citation']}]\n{chunk['text']}" for chunk in chunks)
+
+
+def build_prompt(question, chunks):
+    return (
+        "Answer the question using only the passages below. "
+        "After each fact, cite the passage it came from in square brackets, e.g. [notes.pdf, p. 3].\n\n"
+        f"Question: {question}\n\n"
+        f"Passages:\n{format_passages(chunks)}"
+    )
@@ -0,0 +1,201 @@
+"""Course rosters: which students are enrolled in which course and section.
+
+    python roster.py enrolments.csv
+
+Input is CSV (header: student_id,name,course[,section]) or JSON Lines with the
+same keys. Existing enrolments are updated in place, so re-importing a term's
+file is safe.
+"""
+import argparse
+import sys
+import threading
+
+import db
+import provision
+
+# The roster lives next to the attendance records so a whole class can be marked in one statement
+ROSTER_DB = db.ATTENDANCE_DB
+# Sorts after every character, so "prefix" <= key < "prefix" + PREFIX_END matches by prefix
+PREFIX_END = "\U0010ffff"
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def init_roster_db():
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        db.ensure_schema(ROSTER_DB, [
+            """
+            CREATE TABLE IF NOT EXISTS roster (
+                course TEXT NOT NULL,
+                student_id TEXT NOT NULL,
+                section TEXT NOT NULL DEFAULT '',
+                name TEXT NOT NULL,
+                name_key TEXT NOT NULL,  -- casefolded name, for prefix search
+                position INTEGER,  -- the student's bit in the course's attendance bitsets; never reused
+                PRIMARY KEY (course, student_id)
+            ) WITHOUT ROWID
+            """,
+        ])
+        with db.transaction(ROSTER_DB) as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(roster)")]
+            if "position" not in columns:
+                # Rosters imported before positions existed: number each course's students by name
+                conn.execute("ALTER TABLE roster ADD COLUMN position INTEGER")
+                conn.execute("""
+                    UPDATE roster SET position = numbered.position
+                    FROM (
+                        SELECT course, student_id, ROW_NUMBER() OVER (PARTITION BY course ORDER BY name_key, student_id) - 1 AS position
+                        FROM roster
+                    ) AS numbered
+                    WHERE roster.course = numbered.course AND roster.student_id = numbered.student_id
+                """)
+            # Prefix search and name-ordered paging, with and without a section
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_roster_name ON roster (course, name_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_roster_section_name ON roster (course, section, name_key)")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_roster_position ON roster (course, position)")
+            # Which courses a student is in, for setting their bits when they mark themselves present
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_roster_student ON roster (student_id)")
+        _schema_ready = True
+
+
+def name_key(name):
+    return name.casefold()
+
+
+def enroll(enrolments):
+    """Add or update (course, section, student_id, name) rows; returns how many were written.
+
+    A new student takes the next free position in the course; updates keep it.
+    """
+    init_roster_db()
+    rows = [
+        (str(course).strip(), str(student_id).strip(), str(section or "").strip(), name.strip(), name_key(name.strip()))
+        for course, section, student_id, name in enrolments
+    ]
+    if not rows:
+        return 0
+    with db.transaction(ROSTER_DB) as conn:
+        conn.executemany(
+            """
+            INSERT INTO roster (course, student_id, section, name, name_key, position)
+            SELECT ?1, ?2, ?3, ?4, ?5, COALESCE((SELECT MAX(position) + 1 FROM roster WHERE course = ?1), 0) WHERE true
+            ON CONFLICT (course, student_id) DO UPDATE SET section = excluded.section, name = excluded.name, name_key = excluded.name_key
+            """,
+            rows,
+        )
+    return len(rows)
+
+
+def courses():
+    init_roster_db()
+    return [row[0] for row in db.query(ROSTER_DB, "SELECT DISTINCT course FROM roster ORDER BY course")]
+
+
+def sections(course):
+    init_roster_db()
+    rows = db.query(ROSTER_DB, "SELECT DISTINCT section FROM roster WHERE course = ? ORDER BY section", (course,))
+    return [row[0] for row in rows]
+
+
+def count(course=None, section=None):
+    """Students enrolled in a course (and section), or distinct students across every course."""
+    init_roster_db()
+    if course is None:
+        return db.query_one(ROSTER_DB, "SELECT COUNT(DISTINCT student_id) FROM roster")[0]
+    if section is None:
+        return db.query_one(ROSTER_DB, "SELECT COUNT(*) FROM roster WHERE course = ?", (course,))[0]
+    return db.query_one(ROSTER_DB, "SELECT COUNT(*) FROM roster WHERE course = ? AND section = ?", (course, section))[0]
+
+
+def search(course, section=None, prefix="", limit=25, after=None):
+    """One page of (student_id, name, section) ordered by name.
+
+    ``prefix`` matches the start of the name (case-insensitively) or of the
+    student ID; both are index range scans, so the cost doesn't grow with the
+    class. Pages are keyset-based: pass ``cursor(row)`` of the previous page's
+    last row as ``after``.
+    """
+    init_roster_db()
+    scope = "course = ?" + (" AND section = ?" if section is not None else "")
+    scope_params = (course,) + ((section,) if section is not None else ())
+    after_key, after_id = after or ("", "")
+    page = "(name_key, student_id) > (?, ?)"
+    key = name_key(prefix.strip())
+    arms = [f"SELECT student_id, name, section, name_key FROM roster WHERE {scope} AND name_key >= ? AND name_key < ? AND {page}"]
+    params = [*scope_params, key, key + PREFIX_END, after_key, after_id]
+    if key:
+        arms.append(f"SELECT student_id, name, section, name_key FROM roster WHERE {scope} AND student_id >= ? AND student_id < ? AND {page}")
+        params += [*scope_params, prefix.strip(), prefix.strip() + PREFIX_END, after_key, after_id]
+    rows = db.query(
+        ROSTER_DB,
+        f"{' UNION '.join(arms)} ORDER BY name_key, student_id LIMIT ?",
+        (*params, limit),
+    )
+    return [row[:3] for row in rows]
+
+
+def positions(course):
+    """(position, student_id, name, section) for everyone in a course, in position order."""
+    init_roster_db()
+    return db.query(
+        ROSTER_DB,
+        "SELECT position, student_id, name, section FROM roster WHERE course = ? ORDER BY position",
+        (course,),
+    )
+
+
+def is_enrolled(student_id, course, section=None):
+    init_roster_db()
+    scope = " AND section = ?" if section is not None else ""
+    return db.query_one(
+        ROSTER_DB,
+        f"SELECT 1 FROM roster WHERE course = ? AND student_id = ?{scope}",
+        (course, student_id, *((section,) if section is not None else ())),
+    ) is not None
+
+
+def cursor(row):
+    student_id, name, _ = row
+    return (name_key(name), student_id)
+
+
+def read_enrolments(rows, errors):
+    """Yield (course, section, student_id, name) from (line number, row dict) pairs, collecting bad rows."""
+    for number, row in rows:
+        if "_error" in row:
+            errors.append((number, "", row["_error"]))
+            continue
+        student_id = str(row.get("student_id") or "").strip()
+        name = str(row.get("name") or "").strip()
+        course = str(row.get("course") or "").strip()
+        if not student_id.isdigit():
+            errors.append((number, student_id, "student_id must be numerical"))
+        elif not name or not course:
+            errors.append((number, student_id, "name and course are required"))
+        else:
+            yield course, row.get("section") or "", student_id, name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import course enrolments from CSV or JSON Lines.")
+    parser.add_argument("path", help="CSV (student_id,name,course[,section]) or .jsonl file")
+    args = parser.parse_args()
+
+    errors = []
+    enrolled = enroll(read_enrolments(provision.read_rows(args.path), errors))
+    # Attendance recorded before these students were enrolled now counts for their courses
+    import bitsets
+    bitsets.rebuild()
+    for number, student_id, reason in errors:
+        print(f"line {number}: {student_id or '?'}: {reason}", file=sys.stderr)
+    print(f"Enrolled {enrolled} students, rejected {len(errors)}.")
+    db.close_all()
+    return 0 if not errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
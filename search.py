@@ -0,0 +1,187 @@
+"""Full-text search over the extracted text of every uploaded material, one FTS5 row per page.
+
+    python search.py reindex [--full]
+    python search.py "entropy of mixing"
+
+Ingestion indexes each material's pages in the same transaction that stores
+its chunks, so the index follows every upload. ``reindex`` only touches
+materials that are missing from it (or, with ``full``, rebuilds it) and is how
+materials ingested before the index existed get added.
+"""
+import argparse
+import re
+import sys
+import threading
+from datetime import datetime
+
+import db
+import extraction
+import materials
+
+SEARCH_DB = db.MATERIALS_DB
+RESULT_LIMIT = 20
+# Words of context around the matches in a snippet
+SNIPPET_WORDS = 24
+# Matches in the filename count for more than matches in the text
+FILENAME_WEIGHT = 4.0
+
+_TOKEN_RE = re.compile(r"\w+")
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def init_search_db():
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        materials.init_materials_db()
+        db.ensure_schema(SEARCH_DB, [
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS material_pages USING fts5 (
+                sha256 UNINDEXED,
+                page UNINDEXED,
+                filename,
+                text,
+                tokenize = 'porter unicode61 remove_diacritics 2'
+            )
+            """,
+            # Which materials are in the index, so reindexing can skip them
+            """
+            CREATE TABLE IF NOT EXISTS search_documents (
+                sha256 TEXT PRIMARY KEY,
+                pages INTEGER NOT NULL,
+                indexed_at TEXT NOT NULL
+            )
+            """,
+        ])
+        # Stored in the index, so ORDER BY rank uses the weights without recomputing them per query
+        db.execute(
+            SEARCH_DB,
+            "INSERT INTO material_pages (material_pages, rank) VALUES ('rank', ?)",
+            (f"bm25(0.0, 0.0, {FILENAME_WEIGHT}, 1.0)",),
+        )
+        _schema_ready = True
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def index_material(conn, sha256, filename, pages):
+    """Replace a material's pages in the index, inside the caller's transaction."""
+    conn.execute("DELETE FROM material_pages WHERE sha256 = ?", (sha256,))
+    conn.executemany(
+        "INSERT INTO material_pages (sha256, page, filename, text) VALUES (?, ?, ?, ?)",
+        [(sha256, number, filename, text) for number, text in enumerate(pages, start=1) if text.strip()],
+    )
+    conn.execute(
+        """
+        INSERT INTO search_documents (sha256, pages, indexed_at) VALUES (?, ?, ?)
+        ON CONFLICT (sha256) DO UPDATE SET pages = excluded.pages, indexed_at = excluded.indexed_at
+        """,
+        (sha256, len(pages), _now()),
+    )
+
+
+def reindex(full=False, sha256s=None):
+    """Index materials that aren't in the index yet (all of them with ``full``); returns how many were indexed.
+
+    ``sha256s`` limits the pass to those materials. Pages come from the
+    extraction cache, so materials that were already ingested aren't parsed again.
+    """
+    init_search_db()
+    with db.transaction(SEARCH_DB) as conn:
+        if full:
+            conn.execute("DELETE FROM material_pages")
+            conn.execute("DELETE FROM search_documents")
+        else:
+            # Drop materials that are no longer in the catalog
+            conn.execute("DELETE FROM material_pages WHERE sha256 NOT IN (SELECT sha256 FROM materials WHERE sha256 IS NOT NULL)")
+            conn.execute("DELETE FROM search_documents WHERE sha256 NOT IN (SELECT sha256 FROM materials WHERE sha256 IS NOT NULL)")
+    missing = db.query(
+        SEARCH_DB,
+        """
+        SELECT m.sha256, m.filename, m.mime_type FROM materials m
+        LEFT JOIN search_documents d ON d.sha256 = m.sha256
+        WHERE m.sha256 IS NOT NULL AND d.sha256 IS NULL
+        ORDER BY m.id
+        """,
+    )
+    wanted = set(sha256s) if sha256s is not None else None
+    indexed = 0
+    for sha256, filename, mime_type in missing:
+        if wanted is not None and sha256 not in wanted:
+            continue
+        kind = extraction.kind_for_mime(mime_type)
+        try:
+            # Other file types are recorded with no pages so they aren't retried
+            pages = extraction.extract_pages(materials.read_material(sha256), kind, sha256) if kind else []
+        except Exception:
+            # Left out of search_documents, so the next pass tries again
+            continue
+        with db.transaction(SEARCH_DB) as conn:
+            index_material(conn, sha256, filename, pages)
+        indexed += 1
+    if indexed or full:
+        # Merge the index segments the inserts created into one b-tree
+        db.execute(SEARCH_DB, "INSERT INTO material_pages (material_pages) VALUES ('optimize')")
+    return indexed
+
+
+def match_expression(query):
+    """An FTS5 query matching pages that contain every word, the last one as a prefix.
+
+    Words are quoted, so whatever the user types can't be read as FTS5 syntax.
+    """
+    words = _TOKEN_RE.findall(query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+
+def search(query, limit=RESULT_LIMIT):
+    """The best-matching pages, most relevant first, with the matches in the snippet in **bold**."""
+    expression = match_expression(query)
+    if not expression:
+        return []
+    init_search_db()
+    rows = db.query(
+        SEARCH_DB,
+        # Ranked and cut to the limit inside FTS5 first, so snippets are only built for the pages returned
+        f"""
+        SELECT p.sha256, p.page, m.id, m.filename, m.mime_type, p.snippet
+        FROM (
+            SELECT sha256, page, rank, snippet(material_pages, 3, '**', '**', ' ... ', {SNIPPET_WORDS}) AS snippet
+            FROM material_pages
+            WHERE material_pages MATCH ?
+            ORDER BY rank
+            LIMIT ?
+        ) p
+        JOIN materials m ON m.sha256 = p.sha256
+        ORDER BY p.rank
+        """,
+        (expression, limit),
+    )
+    return [dict(zip(("sha256", "page", "id", "filename", "mime_type", "snippet"), row)) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the uploaded materials or bring the search index up to date.")
+    parser.add_argument("query", help="words to search for, or 'reindex'")
+    parser.add_argument("--full", action="store_true", help="with reindex: rebuild the whole index")
+    parser.add_argument("--limit", type=int, default=RESULT_LIMIT)
+    args = parser.parse_args()
+
+    if args.query == "reindex":
+        print(f"Indexed {reindex(args.full)} materials.")
+    else:
+        for result in search(args.query, args.limit):
+            print(f"{result['filename']} p. {result['page']}: {' '.join(result['snippet'].split())}")
+    db.close_all()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import llm
+import retrieval
+import tracing
+
+# Source text per map request
+GROUP_TOKENS = 12000
+# Combined notes larger than this are condensed again before the final answer
+REDUCE_TOKENS = 24000
+# Map requests in flight at once for one document
+MAP_WORKERS = 4
+# Condense rounds before the notes are truncated to fit
+MAX_COLLAPSE_ROUNDS = 3
+
+
+def group_chunks(chunks, max_tokens=GROUP_TOKENS):
+    """Pack consecutive chunks into groups of at most max_tokens (a single oversized chunk gets its own group)."""
+    groups = []
+    current = []
+    used = 0
+    for chunk in chunks:
+        if current and used + chunk["tokens"] > max_tokens:
+            groups.append(current)
+            current = []
+            used = 0
+        current.append(chunk)
+        used += chunk["tokens"]
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _map_prompt(passages, question):
+    if question:
+        task = (
+            f"List every fact in the passages below that helps answer the question: {question}\n"
+            "Cite the passage each fact came from in square brackets. If nothing is relevant, reply 'Nothing relevant.'"
+        )
+    else:
+        task = "Summarize the passages below in a few bullet points, citing the passage each point came from in square brackets."
+    return f"{task}\n\nPassages:\n{passages}"
+
+
+def _reduce_prompt(notes, question, final):
+    joined = "\n\n".join(notes)
+    if not final:
+        return (
+            "Condense these notes on parts of one document into a single shorter set of notes. "
+            f"Keep the citations in square brackets.\n\n{joined}"
+        )
+    if question:
+        return (
+            "The notes below were taken from every part of a document. "
+            f"Using only these notes, answer the question and keep their citations in square brackets.\n\n"
+            f"Question: {question}\n\nNotes:\n{joined}"
+        )
+    return (
+        "The notes below summarize every part of a document in order. "
+        f"Write one coherent summary of the whole document, keeping their citations in square brackets.\n\n{joined}"
+    )
+
+
+def _run_parallel(model_instance, prompts, page, workers, user=None):
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(prompts)))) as pool:
+        generate = tracing.propagate(lambda prompt: llm.generate(model_instance, [prompt], page, user=user))
+        return list(pool.map(generate, prompts))
+
+
+def map_reduce(model_instance, chunks, question=None, workers=MAP_WORKERS, progress=None, user=None):
+    """Answer a question about (or summarize) a document too large to send in one request.
+
+    Groups of chunks are summarized in parallel with at most ``workers``
+    requests in flight, the notes are condensed until they fit, and one final
+    request produces the answer. Returns a dict with the text, the number of
+    groups and the seconds spent in each stage. ``progress`` is called with
+    the name of each stage as it starts. Requests count against ``user``'s
+    concurrency limit, so they never run more than that many at once.
+    """
+    timings = {}
+    if user is not None:
+        # More threads than the user's slots would only queue for them
+        workers = min(workers, llm.PER_USER_CONCURRENT)
+    groups = group_chunks(chunks)
+    if len(groups) <= 1:
+        # Small enough for a single request
+        if progress:
+            progress("reduce")
+        started = time.perf_counter()
+        passages = retrieval.format_passages(chunks)
+        prompt = retrieval.build_prompt(question, chunks) if question else _map_prompt(passages, None)
+        text = llm.generate(model_instance, [prompt], "summary_reduce", user=user)
+        timings["reduce"] = time.perf_counter() - started
+        return {"text": text, "groups": len(groups), "timings": timings}
+
+    if progress:
+        progress("map")
+    started = time.perf_counter()
+    prompts = [_map_prompt(retrieval.format_passages(group), question) for group in groups]
+    notes = _run_parallel(model_instance, prompts, "summary_map", workers, user)
+    timings["map"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(MAX_COLLAPSE_ROUNDS):
+        if sum(retrieval.estimate_tokens(note) for note in notes) <= REDUCE_TOKENS:
+            break
+        if progress:
+            progress("collapse")
+        batches = group_chunks([{"text": note, "tokens": retrieval.estimate_tokens(note)} for note in notes], REDUCE_TOKENS)
+        prompts = [_reduce_prompt([item["text"] for item in batch], question, final=False) for batch in batches]
+        notes = _run_parallel(model_instance, prompts, "summary_collapse", workers, user)
+    timings["collapse"] = time.perf_counter() - started
+
+    if progress:
+        progress("reduce")
+    started = time.perf_counter()
+    # Whatever still doesn't fit after the collapse rounds is cut at the budget
+    notes = ["\n\n".join(notes)[:REDUCE_TOKENS * 4]]
+    text = llm.generate(model_instance, [_reduce_prompt(notes, question, final=True)], "summary_reduce", user=user)
+    timings["reduce"] = time.perf_counter() - started
+    return {"text": text, "groups": len(groups), "timings": timings}
@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+
+import pytz
+import requests
+
+import tracing
+
+IPINFO_URL = "https://ipinfo.io/json"
+IPINFO_IP_URL = "https://ipinfo.io/{ip}/json"
+# Outbound lookups never hold up a rerun for longer than this
+LOOKUP_TIMEOUT = 2.0
+# How long a resolved timezone is trusted before it is looked up again
+CACHE_TTL = 6 * 60 * 60
+# Failed lookups (private addresses, timeouts) are retried after this long
+FAILED_LOOKUP_TTL = 5 * 60
+# Addresses kept at once; the least recently used is dropped first
+IP_CACHE_SIZE = 4096
+
+_ip_cache = OrderedDict()
+_pending = set()
+_lock = threading.Lock()
+
+
+def is_valid_timezone(name):
+    return bool(name) and name in pytz.all_timezones_set
+
+
+def _lookup(ip):
+    url = IPINFO_IP_URL.format(ip=ip) if ip else IPINFO_URL
+    timezone = None
+    with tracing.trace("timezone_lookup", kind="job"), tracing.span("http", "ipinfo.io") as details:
+        try:
+            response = requests.get(url, timeout=LOOKUP_TIMEOUT)
+            details["status"] = response.status_code
+            if response.status_code == 200:
+                timezone = response.json().get("timezone")
+        except (requests.RequestException, ValueError) as e:
+            details["error"] = e.__class__.__name__
+    if not is_valid_timezone(timezone):
+        timezone = None
+    with _lock:
+        _pending.discard(ip)
+        _ip_cache[ip] = (timezone, time.monotonic() + (CACHE_TTL if timezone else FAILED_LOOKUP_TTL))
+        _ip_cache.move_to_end(ip)
+        while len(_ip_cache) > IP_CACHE_SIZE:
+            _ip_cache.popitem(last=False)
+
+
+def timezone_for_ip(ip):
+    """Return the cached timezone for an IP, or None while a background lookup runs.
+
+    Lookups are shared by every session from the same address and never block
+    the caller; pass ip=None to look up the server's own address.
+    """
+    with _lock:
+        cached = _ip_cache.get(ip)
+        if cached:
+            _ip_cache.move_to_end(ip)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        if ip in _pending:
+            return cached[0] if cached else None
+        _pending.add(ip)
+    threading.Thread(target=_lookup, args=(ip,), daemon=True).start()
+    return cached[0] if cached else None
+
+
+def resolve_timezone(browser_timezone=None, ip=None, default="UTC", ip_lookup=True):
+    """Pick the best known timezone and say where it came from.
+
+    The browser's own timezone wins and needs no outbound call. Otherwise the
+    client's IP is geolocated in the background, and the configured default
+    is used until that answer arrives.
+    """
+    if is_valid_timezone(browser_timezone):
+        return browser_timezone, "browser"
+    if ip_lookup:
+        timezone = timezone_for_ip(ip)
+        if timezone:
+            return timezone, "ip"
+    return (default if is_valid_timezone(default) else "UTC"), "default"
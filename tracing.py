@@ -0,0 +1,240 @@
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# One JSON line per rerun (or background job); the backlog already lives in requests.jsonl
+LOG_PATH = "request_log.jsonl"
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+# Spans kept per trace; a runaway loop shouldn't produce a megabyte line
+MAX_SPANS = 500
+# Recent traces kept in memory for the slowest-operations panel
+RECENT_TRACES = 500
+SQL_PREVIEW = 120
+
+_settings = {"enabled": True, "path": LOG_PATH, "max_bytes": MAX_BYTES, "backup_count": BACKUP_COUNT}
+_local = threading.local()
+_recent = deque(maxlen=RECENT_TRACES)
+_lock = threading.Lock()
+_logger = None
+
+
+class Trace:
+    """The spans recorded during one rerun or background job."""
+
+    def __init__(self, kind, name, user=None):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.name = name
+        self.page = None
+        self.user = user
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def add(self, kind, name, started, seconds, depth, attrs):
+        span = {"kind": kind, "name": name, "at_ms": round((started - self.started) * 1000, 2), "ms": round(seconds * 1000, 2), "depth": depth}
+        span.update(attrs)
+        with self.lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    def record(self, seconds, exit=None):
+        totals = {}
+        for span in self.spans:
+            if span["kind"] != "page":
+                totals[span["kind"]] = round(totals.get(span["kind"], 0) + span["ms"], 2)
+        return {
+            "trace_id": self.id,
+            "kind": self.kind,
+            "name": self.name,
+            "page": self.page,
+            "user": self.user,
+            "ts": round(self.started_at, 3),
+            "ms": round(seconds * 1000, 2),
+            "exit": exit,
+            "totals_ms": totals,
+            "spans": self.spans,
+            "dropped_spans": self.dropped,
+        }
+
+
+def configure(enabled=None, path=None, max_bytes=None, backup_count=None):
+    """Apply deployment settings (e.g. from st.secrets); call before the first trace."""
+    global _logger
+    with _lock:
+        if enabled is not None:
+            _settings["enabled"] = bool(enabled)
+        if path:
+            _settings["path"] = path
+        if max_bytes:
+            _settings["max_bytes"] = int(max_bytes)
+        if backup_count is not None:
+            _settings["backup_count"] = int(backup_count)
+        if _logger is not None:
+            for handler in list(_logger.handlers):
+                _logger.removeHandler(handler)
+                handler.close()
+            _logger = None
+
+
+def _get_logger():
+    # RotatingFileHandler serializes writes from every session and rolls the file over at max_bytes
+    global _logger
+    with _lock:
+        if _logger is None:
+            handler = logging.handlers.RotatingFileHandler(
+                _settings["path"], maxBytes=_settings["max_bytes"], backupCount=_settings["backup_count"], encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger(f"{__name__}.{os.path.abspath(_settings['path'])}")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _logger = logger
+        return _logger
+
+
+def _write(record):
+    with _lock:
+        _recent.append(record)
+    if _settings["enabled"]:
+        _get_logger().info(json.dumps(record, default=str, separators=(",", ":")))
+
+
+def current():
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def trace(name, user=None, kind="rerun"):
+    """Collect spans for the block on this thread and write them as one record when it ends."""
+    outer = current()
+    outer_stack = getattr(_local, "stack", None)
+    t = Trace(kind, name, user)
+    _local.trace = t
+    _local.stack = []
+    exit = None
+    try:
+        yield t
+    except BaseException as e:
+        # st.stop() and st.rerun() end a rerun by raising, so this isn't necessarily an error
+        exit = e.__class__.__name__
+        raise
+    finally:
+        _local.trace = outer
+        _local.stack = outer_stack
+        _write(t.record(time.perf_counter() - t.started, exit))
+
+
+@contextmanager
+def attach(t):
+    """Record spans from a worker thread into another thread's trace."""
+    outer = current()
+    outer_stack = getattr(_local, "stack", None)
+    _local.trace = t
+    _local.stack = []
+    try:
+        yield
+    finally:
+        _local.trace = outer
+        _local.stack = outer_stack
+
+
+def propagate(fn):
+    """Wrap fn so that, run on a pool thread, its spans land in the caller's trace."""
+    t = current()
+    if t is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with attach(t):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def span(kind, name, **attrs):
+    """Time the block as one operation of the current trace; a no-op outside a trace."""
+    t = current()
+    if t is None:
+        yield attrs
+        return
+    if kind == "page":
+        t.page = name
+    stack = _local.stack
+    depth = len(stack)
+    stack.append(attrs)
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["exit"] = e.__class__.__name__
+        raise
+    finally:
+        stack.pop()
+        t.add(kind, name, started, time.perf_counter() - started, depth, attrs)
+
+
+def annotate(**attrs):
+    """Add details to the innermost open span."""
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1].update(attrs)
+
+
+def record(kind, name, seconds, **attrs):
+    """Add an operation that was timed elsewhere and has just finished."""
+    t = current()
+    if t is not None:
+        now = time.perf_counter()
+        t.add(kind, name, now - seconds, seconds, len(getattr(_local, "stack", None) or []), attrs)
+
+
+def traced(kind):
+    """Decorator form of span(), named after the function."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(kind, fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def sql_preview(sql):
+    text = " ".join(sql.split())
+    return text if len(text) <= SQL_PREVIEW else text[:SQL_PREVIEW] + "..."
+
+
+def slowest_operations(limit=20, kind=None):
+    """The slowest spans across recent traces, slowest first."""
+    with _lock:
+        traces = list(_recent)
+    operations = []
+    for t in traces:
+        for s in t["spans"]:
+            if s["kind"] == "page" or (kind and s["kind"] != kind):
+                continue
+            operations.append(dict(s, page=t["page"] or t["name"], user=t["user"], trace_id=t["trace_id"]))
+    operations.sort(key=lambda s: s["ms"], reverse=True)
+    return operations[:limit]
+
+
+def slowest_traces(limit=20):
+    with _lock:
+        traces = list(_recent)
+    traces.sort(key=lambda t: t["ms"], reverse=True)
+    return traces[:limit]